@@ -1,7 +1,7 @@
 "use client";
 
 import Image from "next/image";
-import { useEffect, useMemo, useState } from "react";
+import { useEffect, useMemo, useRef, useState } from "react";
 
 type UiError = { error: string };
 
@@ -11,6 +11,12 @@ type ApiOkResponse = {
   ctx: unknown;
 };
 
+// POST /task only queues the run; planning finishes in the background.
+type TaskAcceptedResponse = {
+  run_id: number;
+  status: string;
+};
+
 type ExecuteStepOkResponse = {
   run_id: number;
   status: string;
@@ -18,6 +24,7 @@ type ExecuteStepOkResponse = {
 };
 
 type RunLogItem = {
+  id: number;
   ts: string;
   level: string;
   message: string;
@@ -36,13 +43,20 @@ type RunDetailsOkResponse = {
 
 type UiResult<T> = T | UiError;
 
+// Page size for GET /runs/{id} logs (backend default is 200).
+const LOG_PAGE_SIZE = 200;
+
+// How often (and how long) createRun polls a PLANNING run.
+const PLAN_POLL_MS = 1000;
+const PLAN_POLL_MAX_TRIES = 120;
+
 function isRecord(v: unknown): v is Record<string, unknown> {
   return typeof v === "object" && v !== null;
 }
 
-function isApiOkResponse(v: unknown): v is ApiOkResponse {
+function isTaskAcceptedResponse(v: unknown): v is TaskAcceptedResponse {
   return (
-    isRecord(v) && typeof v.run_id === "number" && "plan" in v && "ctx" in v
+    isRecord(v) && typeof v.run_id === "number" && typeof v.status === "string"
   );
 }
 
@@ -58,6 +72,7 @@ function isExecuteStepOkResponse(v: unknown): v is ExecuteStepOkResponse {
 function isRunLogItem(v: unknown): v is RunLogItem {
   return (
     isRecord(v) &&
+    typeof v.id === "number" &&
     typeof v.ts === "string" &&
     typeof v.level === "string" &&
     typeof v.message === "string" &&
@@ -208,6 +223,9 @@ export default function Home() {
     useState<UiResult<RunDetailsOkResponse> | null>(null);
 
   const [autoRefresh, setAutoRefresh] = useState(false);
+
+  // Logs fetched so far for the current run; silent polls only ask for newer ones.
+  const logsRef = useRef<{ runId: number; logs: RunLogItem[] } | null>(null);
   const [toast, setToast] = useState<string | null>(null);
 
   const [showScrollTop, setShowScrollTop] = useState(false);
@@ -321,7 +339,7 @@ export default function Home() {
         return;
       }
 
-      if (!isApiOkResponse(data)) {
+      if (!isTaskAcceptedResponse(data)) {
         setCreateResult({
           error: "Invalid API response (missing expected fields).",
         });
@@ -329,7 +347,7 @@ export default function Home() {
       }
 
       setRunId(data.run_id);
-      setCreateResult(data);
+      setCreateResult(await waitForPlan(data.run_id));
     } catch (e: unknown) {
       const message = e instanceof Error ? e.message : String(e);
       setCreateResult({ error: message });
@@ -338,6 +356,39 @@ export default function Home() {
     }
   }
 
+  // Poll the run until planning finishes; plan + ctx come from the "Run created" log.
+  async function waitForPlan(id: number): Promise<UiResult<ApiOkResponse>> {
+    for (let i = 0; i < PLAN_POLL_MAX_TRIES; i++) {
+      await new Promise((r) => window.setTimeout(r, PLAN_POLL_MS));
+
+      const res = await fetch(`${apiBase}/runs/${id}`, { method: "GET" });
+      const page = await safeReadJson(res);
+
+      if (!res.ok) return { error: toErrorMessage(page, res.status) };
+      if (!isRunDetailsOkResponse(page)) {
+        return { error: "Invalid API response when reading run details." };
+      }
+      if (page.run.status === "PLANNING") continue;
+
+      if (page.run.status === "ERROR") {
+        const failed = page.logs.find(
+          (l) => l.message === "Planning failed" || l.message === "Planning interrupted"
+        );
+        const err =
+          failed && isRecord(failed.data) && typeof failed.data.error === "string"
+            ? failed.data.error
+            : "Planning failed.";
+        return { error: err };
+      }
+
+      const created = page.logs.find((l) => l.message === "Run created");
+      const ctx =
+        created && isRecord(created.data) ? created.data.ctx : undefined;
+      return { run_id: id, plan: page.run.plan, ctx: ctx ?? [] };
+    }
+    return { error: "Timed out waiting for the plan." };
+  }
+
   async function refreshRun(opts?: { silent?: boolean }) {
     if (!runId) return;
 
@@ -348,22 +399,50 @@ export default function Home() {
     }
 
     try {
-      const res = await fetch(`${apiBase}/runs/${runId}`, { method: "GET" });
-      const data = await safeReadJson(res);
-
-      if (!res.ok) {
-        setRunDetails({ error: toErrorMessage(data, res.status) });
-        return;
-      }
+      const cached =
+        opts?.silent && logsRef.current?.runId === runId
+          ? logsRef.current.logs
+          : [];
+      const logs = [...cached];
+      let data: RunDetailsOkResponse | null = null;
+
+      // Without since_ts the API returns the newest page (the tail); after that,
+      // page forward from the newest log we have until a short page. The cursor is
+      // (ts, id): several logs can share a ts.
+      for (;;) {
+        const qs = new URLSearchParams({ limit: String(LOG_PAGE_SIZE) });
+        if (logs.length > 0) {
+          const last = logs[logs.length - 1];
+          qs.set("since_ts", last.ts);
+          qs.set("since_id", String(last.id));
+        }
 
-      if (!isRunDetailsOkResponse(data)) {
-        setRunDetails({
-          error: "Invalid API response when reading run details.",
+        const res = await fetch(`${apiBase}/runs/${runId}?${qs}`, {
+          method: "GET",
         });
-        return;
+        const page = await safeReadJson(res);
+
+        if (!res.ok) {
+          setRunDetails({ error: toErrorMessage(page, res.status) });
+          return;
+        }
+
+        if (!isRunDetailsOkResponse(page)) {
+          setRunDetails({
+            error: "Invalid API response when reading run details.",
+          });
+          return;
+        }
+
+        data = page;
+        logs.push(...page.logs);
+        if (page.logs.length < LOG_PAGE_SIZE) break;
       }
 
-      setRunDetails(data);
+      if (!data) return;
+
+      logsRef.current = { runId, logs };
+      setRunDetails({ ...data, logs });
     } catch (e: unknown) {
       const message = e instanceof Error ? e.message : String(e);
       setRunDetails({ error: message });
@@ -827,8 +906,8 @@ export default function Home() {
                       <div className="text-sm muted">No logs yet.</div>
                     ) : (
                       <ul className="space-y-2">
-                        {humanLogs.slice(0, 120).map((l, idx) => (
-                          <li key={`${l.ts}-${idx}`} className="text-xs">
+                        {humanLogs.slice(0, 120).map((l) => (
+                          <li key={l.id} className="text-xs">
                             <div className="flex gap-2">
                               <span className="muted w-19.5 shrink-0">
                                 {formatTs(l.ts)}
@@ -111,15 +111,27 @@ $response = Invoke-RestMethod -Method Post `
 $runId = $response.run_id
 Write-Host "Run ID: $runId"
 
+# Planning runs in the background; wait until the run leaves PLANNING.
+$planDeadline = (Get-Date).AddSeconds(120)
+do {
+    if ((Get-Date) -gt $planDeadline) {
+        throw "Timeout waiting for run $runId to finish planning"
+    }
+    Start-Sleep -Seconds 1
+    $status = (Invoke-RestMethod -Uri "http://localhost:8000/runs/$runId").run.status
+} while ($status -eq "PLANNING")
+Write-Host "Run status: $status"
+if ($status -eq "ERROR") {
+    throw "Planning failed for run $runId; see GET http://localhost:8000/runs/$runId"
+}
+
 # -----------------------------
 # 6. Execute UI steps
 # -----------------------------
 Write-Host "Executing UI steps..."
-for ($i = 0; $i -lt 6; $i++) {
-    Invoke-RestMethod -Method Post `
-        -Uri "http://localhost:8000/runs/$runId/execute-next-ui-step" | Out-Null
-    Start-Sleep -Seconds 2
-}
+$steps = Invoke-RestMethod -Method Post `
+    -Uri "http://localhost:8000/runs/$runId/execute-remaining-ui-steps"
+Write-Host "Run status: $($steps.status) (executed: $($steps.executed_step_ids -join ', '))"
 
 # -----------------------------
 # 7. Fetch run details
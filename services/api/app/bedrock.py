@@ -1,14 +1,14 @@
 from __future__ import annotations
 
 import hashlib
-import json
-import math
-import random
 import re
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
 from typing import Any, Optional
-from urllib.parse import urlparse
 
 import boto3
+import numpy as np
+import orjson
 from botocore.config import Config
 from botocore.exceptions import (
     ClientError,
@@ -17,22 +17,26 @@ from botocore.exceptions import (
     UnauthorizedSSOTokenError,
 )
 
-from .config import settings
-from .url_utils import sanitize_http_url
+from . import config
+from .url_utils import split_http_url
 
 # Cache the Bedrock Runtime client. Recreate it if an SSO token expires.
 _bedrock_client = None
 
+# Bulk embedding fan-out: shared worker pool of settings.EMBED_CONCURRENCY threads,
+# matched by the client's HTTP connection pool.
+_embed_executor: ThreadPoolExecutor | None = None
+
+# Mock planner prompt parsing (compiled once; used on every mock plan)
+_TASK_RE = re.compile(r"TASK:\s*(.*?)\s*\n\s*\nBRAND KIT CONTEXT:", re.DOTALL | re.IGNORECASE)
+_URL_RE = re.compile(r"(https?://[^\s\"\'\)\]]+)")
+
 
 # -----------------------------
 # Helpers
 # -----------------------------
-def _provider() -> str:
-    return (settings.NOVA_PROVIDER or "bedrock").strip().lower()
-
-
 def _aws_login_hint() -> str:
-    prof = settings.AWS_PROFILE
+    prof = config.settings.AWS_PROFILE
     if prof:
         return (
             f"Run:\n"
@@ -48,16 +52,16 @@ def _aws_login_hint() -> str:
     )
 
 
+_TOKEN_ERROR_CODES = frozenset({"UnauthorizedException", "UnrecognizedClientException", "ExpiredTokenException"})
+
+
 def _looks_like_token_problem(err: ClientError) -> bool:
-    code = (err.response.get("Error", {}) or {}).get("Code", "") or ""
-    msg = (err.response.get("Error", {}) or {}).get("Message", "") or ""
-    msg_l = msg.lower()
-    return (
-        code in ("UnauthorizedException", "UnrecognizedClientException", "ExpiredTokenException")
-        or "token" in msg_l
-        or "expired" in msg_l
-        or "sso" in msg_l
-    )
+    error = err.response.get("Error", {}) or {}
+    if (error.get("Code", "") or "") in _TOKEN_ERROR_CODES:
+        return True
+    # Unknown code: fall back to sniffing the message.
+    msg_l = (error.get("Message", "") or "").lower()
+    return "token" in msg_l or "expired" in msg_l or "sso" in msg_l
 
 
 def _looks_like_on_demand_problem(err: ClientError) -> bool:
@@ -67,14 +71,27 @@ def _looks_like_on_demand_problem(err: ClientError) -> bool:
 
 
 def _safe_json_dumps(obj: Any) -> str:
-    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+    # orjson emits compact UTF-8 output, same as json.dumps(ensure_ascii=False, separators=(",", ":")).
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+
+
+# Titan embed request envelope, prebuilt per supported dimension; only inputText varies per call.
+_EMBED_BODY_HEAD = b'{"inputText":'
+_EMBED_BODY_TAILS = {dim: b',"dimensions":%d,"normalize":true}' % dim for dim in (1024, 512, 256)}
+
+
+def _embed_request_body(text: str, dim: int) -> bytes:
+    tail = _EMBED_BODY_TAILS.get(dim)
+    if tail is None:
+        return orjson.dumps({"inputText": text, "dimensions": dim, "normalize": True})
+    return _EMBED_BODY_HEAD + orjson.dumps(text) + tail
 
 
 def _bedrock_chat_model_id() -> str:
     """
     Prefer inference profile if provided, otherwise use direct model ID.
     """
-    return (settings.NOVA_INFERENCE_PROFILE_ID or settings.NOVA_LITE_MODEL_ID).strip()
+    return (config.settings.NOVA_INFERENCE_PROFILE_ID or config.settings.NOVA_LITE_MODEL_ID).strip()
 
 
 # -----------------------------
@@ -91,16 +108,16 @@ def get_bedrock_client():
     if _bedrock_client is not None:
         return _bedrock_client
 
-    region = settings.BEDROCK_REGION
+    region = config.settings.BEDROCK_REGION
 
     try:
-        if settings.AWS_PROFILE:
-            sess = boto3.Session(profile_name=settings.AWS_PROFILE, region_name=region)
+        if config.settings.AWS_PROFILE:
+            sess = boto3.Session(profile_name=config.settings.AWS_PROFILE, region_name=region)
         else:
             sess = boto3.Session(region_name=region)
     except ProfileNotFound as e:
         raise RuntimeError(
-            f"AWS profile '{settings.AWS_PROFILE}' was not found. "
+            f"AWS profile '{config.settings.AWS_PROFILE}' was not found. "
             "Run: aws configure list-profiles"
         ) from e
 
@@ -110,6 +127,7 @@ def get_bedrock_client():
         config=Config(
             read_timeout=3600,
             retries={"max_attempts": 8, "mode": "standard"},
+            max_pool_connections=max(config.settings.EMBED_CONCURRENCY, 10),
         ),
     )
     return _bedrock_client
@@ -129,98 +147,116 @@ def _mock_embed_text(text: str, dimension: int = 1024) -> list[float]:
     if dim <= 0:
         raise ValueError("dimension must be > 0")
 
-    h = hashlib.sha256((f"{dim}::" + (text or "")).encode("utf-8")).digest()
-    seed = int.from_bytes(h[:8], "big", signed=False)
-    rng = random.Random(seed)
+    # Non-cryptographic use: BLAKE2b is faster than sha256 and emits exactly the 16 seed bytes needed.
+    h = hashlib.blake2b((f"{dim}::" + (text or "")).encode("utf-8"), digest_size=16).digest()
+    # Per-call PCG64 generator: thread-safe and never touches NumPy's global RNG state.
+    rng = np.random.Generator(np.random.PCG64(np.frombuffer(h, dtype=np.uint64)))
 
-    vec = [rng.gauss(0.0, 1.0) for _ in range(dim)]
-    norm = math.sqrt(sum(v * v for v in vec)) or 1.0
-    return [v / norm for v in vec]
+    vec = rng.standard_normal(dim, dtype=np.float64)
+    vec /= np.linalg.norm(vec) or 1.0
+    return vec.tolist()
 
 
 def _extract_task_from_prompt(user: str) -> str:
     if not user:
         return ""
-    m = re.search(
-        r"TASK:\s*(.*?)\s*\n\s*\nBRAND KIT CONTEXT:",
-        user,
-        flags=re.DOTALL | re.IGNORECASE,
-    )
+    m = _TASK_RE.search(user)
     if m:
         return (m.group(1) or "").strip()
     return user.strip()
 
 
-def _find_first_url(text: str) -> Optional[str]:
+def _find_first_url(text: str) -> Optional[tuple[str, str]]:
+    """
+    Returns (url, netloc) for the first valid http/https URL in text.
+    """
     if not text:
         return None
-    m = re.search(r"(https?://[^\s\"\'\)\]]+)", text)
+    m = _URL_RE.search(text)
     if not m:
         return None
-    return sanitize_http_url(m.group(1))
+    return split_http_url(m.group(1))
 
 
-def _mock_plan(system: str, user: str) -> str:
-    task = _extract_task_from_prompt(user)
-    task_l = task.lower()
+# Static mock plans are serialized once at import.
+_FORM_AUTH_PLAN_JSON = _safe_json_dumps(
+    {
+        "starting_url": "https://the-internet.herokuapp.com/",
+        "steps": [
+            {"id": "S1", "type": "ui", "instruction": "CLICK_TEXT: Form Authentication", "requires_approval": False, "evidence": "Navigated to Form Authentication page"},
+            {"id": "S2", "type": "ui", "instruction": "TYPE_ID: username=tomsmith", "requires_approval": False, "evidence": "Entered username"},
+            {"id": "S3", "type": "ui", "instruction": "TYPE_ID: password=SuperSecretPassword!", "requires_approval": False, "evidence": "Entered password"},
+            {"id": "S4", "type": "ui", "instruction": "CLICK_CSS: button[type=\"submit\"]", "requires_approval": False, "evidence": "Submitted login form"},
+            {"id": "S5", "type": "ui", "instruction": "WAIT_TEXT: You logged into a secure area!", "requires_approval": False, "evidence": "Verified successful login"},
+            {"id": "S6", "type": "ui", "instruction": "SCREENSHOT: after_login", "requires_approval": False, "evidence": "Captured post-login screen"},
+        ],
+    }
+)
 
-    starting_url = sanitize_http_url(settings.DEMO_STARTING_URL) or "https://the-internet.herokuapp.com/"
+# Generic fallback: only S1 depends on the starting URL host.
+_GENERIC_PLAN_STATIC_STEPS = (
+    {"id": "S2", "type": "ui", "instruction": "SCREENSHOT: landing", "requires_approval": False, "evidence": "Captured landing page screenshot"},
+    {"id": "S3", "type": "ui", "instruction": "WAIT_MS: 500", "requires_approval": False, "evidence": "Brief wait for stability"},
+    {"id": "S4", "type": "ui", "instruction": "SCREENSHOT: landing_2", "requires_approval": False, "evidence": "Captured a second screenshot for evidence"},
+)
 
-    url_in_task = _find_first_url(task)
-    if url_in_task:
-        starting_url = url_in_task
 
-    if ("form authentication" in task_l) or ("tomsmith" in task_l) or ("supersecretpassword" in task_l):
-        plan = {
-            "starting_url": "https://the-internet.herokuapp.com/",
-            "steps": [
-                {"id": "S1", "type": "ui", "instruction": "CLICK_TEXT: Form Authentication", "requires_approval": False, "evidence": "Navigated to Form Authentication page"},
-                {"id": "S2", "type": "ui", "instruction": "TYPE_ID: username=tomsmith", "requires_approval": False, "evidence": "Entered username"},
-                {"id": "S3", "type": "ui", "instruction": "TYPE_ID: password=SuperSecretPassword!", "requires_approval": False, "evidence": "Entered password"},
-                {"id": "S4", "type": "ui", "instruction": "CLICK_CSS: button[type=\"submit\"]", "requires_approval": False, "evidence": "Submitted login form"},
-                {"id": "S5", "type": "ui", "instruction": "WAIT_TEXT: You logged into a secure area!", "requires_approval": False, "evidence": "Verified successful login"},
-                {"id": "S6", "type": "ui", "instruction": "SCREENSHOT: after_login", "requires_approval": False, "evidence": "Captured post-login screen"},
-            ],
-        }
-        return _safe_json_dumps(plan)
-
-    host = urlparse(starting_url).netloc or "the-internet.herokuapp.com"
+@lru_cache(maxsize=256)
+def _generic_plan_json(starting_url: str, host: str) -> str:
     plan = {
         "starting_url": starting_url,
         "steps": [
             {"id": "S1", "type": "ui", "instruction": f"WAIT_URL_CONTAINS: {host}", "requires_approval": False, "evidence": "Page loaded (URL contains expected host)"},
-            {"id": "S2", "type": "ui", "instruction": "SCREENSHOT: landing", "requires_approval": False, "evidence": "Captured landing page screenshot"},
-            {"id": "S3", "type": "ui", "instruction": "WAIT_MS: 500", "requires_approval": False, "evidence": "Brief wait for stability"},
-            {"id": "S4", "type": "ui", "instruction": "SCREENSHOT: landing_2", "requires_approval": False, "evidence": "Captured a second screenshot for evidence"},
+            *_GENERIC_PLAN_STATIC_STEPS,
         ],
     }
     return _safe_json_dumps(plan)
 
 
+def _mock_plan(system: str, user: str, cache_system: bool = False) -> str:
+    return _mock_plan_impl(system, user)
+
+
+@lru_cache(maxsize=256)
+def _mock_plan_impl(system: str, user: str) -> str:
+    """
+    Deterministic for a given (system, user) pair, so demo replays of the
+    same prompt return the cached JSON string.
+    """
+    task = _extract_task_from_prompt(user)
+    task_l = task.lower()
+
+    # Each candidate URL is validated and split once; the netloc is reused below.
+    starting_url, host = (
+        _find_first_url(task)
+        or split_http_url(config.settings.DEMO_STARTING_URL)
+        or ("https://the-internet.herokuapp.com/", "")
+    )
+
+    if ("form authentication" in task_l) or ("tomsmith" in task_l) or ("supersecretpassword" in task_l):
+        return _FORM_AUTH_PLAN_JSON
+
+    return _generic_plan_json(starting_url, host or "the-internet.herokuapp.com")
+
+
 # -----------------------------
-# Public API used by the rest of the app
+# Bedrock calls (real AWS)
 # -----------------------------
-def nova_embed_text(text: str, dimension: int = 1024) -> list[float]:
-    prov = _provider()
-    if prov == "mock":
-        return _mock_embed_text(text, dimension)
-    if prov != "bedrock":
-        raise RuntimeError(f"Unknown NOVA_PROVIDER='{settings.NOVA_PROVIDER}'. Use 'bedrock' or 'mock'.")
-
-    model_id = settings.NOVA_EMBED_MODEL_ID
+def _bedrock_embed_text(text: str, dimension: int = 1024) -> list[float]:
+    model_id = config.settings.NOVA_EMBED_MODEL_ID
     dim = int(dimension) if dimension is not None else 1024
 
     if "titan-embed-text-v2" in (model_id or "").lower():
         if dim not in (1024, 512, 256):
             raise ValueError("For amazon.titan-embed-text-v2:0, dimensions must be 1024, 512, or 256.")
 
-    body = {"inputText": text, "dimensions": dim, "normalize": True}
+    body = _embed_request_body(text, dim)
     bedrock = get_bedrock_client()
 
     try:
         resp = bedrock.invoke_model(
             modelId=model_id,
-            body=json.dumps(body),
+            body=body,
             accept="application/json",
             contentType="application/json",
         )
@@ -231,7 +267,7 @@ def nova_embed_text(text: str, dimension: int = 1024) -> list[float]:
             bedrock = _recreate_client()
             resp = bedrock.invoke_model(
                 modelId=model_id,
-                body=json.dumps(body),
+                body=body,
                 accept="application/json",
                 contentType="application/json",
             )
@@ -240,8 +276,8 @@ def nova_embed_text(text: str, dimension: int = 1024) -> list[float]:
             msg = (e.response.get("Error", {}) or {}).get("Message", "")
             raise RuntimeError(f"Bedrock invoke_model failed for {model_id}: {code} - {msg}") from e
 
-    raw = resp["body"].read()
-    payload = json.loads(raw)
+    # orjson parses the raw response bytes directly (no intermediate str decode).
+    payload = orjson.loads(resp["body"].read())
 
     if "embedding" in payload:
         return payload["embedding"]
@@ -252,34 +288,50 @@ def nova_embed_text(text: str, dimension: int = 1024) -> list[float]:
     raise RuntimeError(f"Unexpected embedding response from model ({model_id}): {payload}")
 
 
-def nova_plan_with_lite(system: str, user: str) -> str:
-    prov = _provider()
-    if prov == "mock":
-        return _mock_plan(system, user)
-    if prov != "bedrock":
-        raise RuntimeError(f"Unknown NOVA_PROVIDER='{settings.NOVA_PROVIDER}'. Use 'bedrock' or 'mock'.")
+def _system_blocks(system: str, cache_system: bool) -> list[dict]:
+    # Fresh list per request: botocore handlers may mutate request params. The cachePoint
+    # marks everything before it as a reusable prompt prefix for Bedrock prompt caching.
+    blocks = [{"text": system}]
+    if cache_system:
+        blocks.append({"cachePoint": {"type": "default"}})
+    return blocks
+
 
+def _client_supports_cache_point(client) -> bool:
+    # botocore releases older than Bedrock prompt caching reject cachePoint client-side.
+    return "cachePoint" in client.meta.service_model.shape_for("SystemContentBlock").members
+
+
+def _looks_like_cache_unsupported(e: ClientError) -> bool:
+    err = e.response.get("Error", {}) or {}
+    return err.get("Code") == "ValidationException" and "cach" in (err.get("Message") or "").lower()
+
+
+def _bedrock_plan_with_lite(system: str, user: str, cache_system: bool = False) -> str:
     bedrock = get_bedrock_client()
     model_id = _bedrock_chat_model_id()
+    cache_system = cache_system and _client_supports_cache_point(bedrock)
+
+    # Built once so the token-refresh retry below sends the identical request.
+    request = {
+        "modelId": model_id,
+        "messages": [{"role": "user", "content": [{"text": user}]}],
+        "system": _system_blocks(system, cache_system),
+        "inferenceConfig": {"maxTokens": 1500, "temperature": 0.2, "topP": 0.9},
+    }
 
     try:
-        resp = bedrock.converse(
-            modelId=model_id,
-            messages=[{"role": "user", "content": [{"text": user}]}],
-            system=[{"text": system}],
-            inferenceConfig={"maxTokens": 1500, "temperature": 0.2, "topP": 0.9},
-        )
+        resp = bedrock.converse(**request)
     except (UnauthorizedSSOTokenError, NoCredentialsError) as e:
         raise RuntimeError("AWS credentials/SSO token not found or expired.\n" + _aws_login_hint()) from e
     except ClientError as e:
         if _looks_like_token_problem(e):
             bedrock = _recreate_client()
-            resp = bedrock.converse(
-                modelId=model_id,
-                messages=[{"role": "user", "content": [{"text": user}]}],
-                system=[{"text": system}],
-                inferenceConfig={"maxTokens": 1500, "temperature": 0.2, "topP": 0.9},
-            )
+            resp = bedrock.converse(**request)
+        elif cache_system and _looks_like_cache_unsupported(e):
+            # Model/region without prompt caching: same request, plain system block.
+            request["system"] = _system_blocks(system, False)
+            resp = bedrock.converse(**request)
         elif _looks_like_on_demand_problem(e):
             msg = (e.response.get("Error", {}) or {}).get("Message", "")
             raise RuntimeError(
@@ -298,3 +350,59 @@ def nova_plan_with_lite(system: str, user: str) -> str:
         return resp["output"]["message"]["content"][0]["text"]
     except Exception as e:
         raise RuntimeError(f"Unexpected Converse response shape: {resp}") from e
+
+
+# -----------------------------
+# Public API used by the rest of the app
+# -----------------------------
+def _unknown_provider(*args: Any, **kwargs: Any):
+    raise RuntimeError(f"Unknown NOVA_PROVIDER='{config.settings.NOVA_PROVIDER}'. Use 'bedrock' or 'mock'.")
+
+
+# The provider is fixed for the life of the process, so resolve the entry points
+# once, on first call (not at import, which must not read settings).
+_provider_fns: tuple | None = None
+
+
+def _provider() -> tuple:
+    global _provider_fns
+    if _provider_fns is None:
+        name = (config.settings.NOVA_PROVIDER or "bedrock").strip().lower()
+        if name == "mock":
+            _provider_fns = (_mock_embed_text, _mock_plan)
+        elif name == "bedrock":
+            _provider_fns = (_bedrock_embed_text, _bedrock_plan_with_lite)
+        else:
+            _provider_fns = (_unknown_provider, _unknown_provider)
+    return _provider_fns
+
+
+def nova_embed_text(text: str, dimension: int = 1024) -> list[float]:
+    return _provider()[0](text, dimension)
+
+
+def nova_plan_with_lite(system: str, user: str, cache_system: bool = False) -> str:
+    return _provider()[1](system, user, cache_system=cache_system)
+
+
+def _get_embed_executor() -> ThreadPoolExecutor:
+    global _embed_executor
+    if _embed_executor is None:
+        _embed_executor = ThreadPoolExecutor(
+            max_workers=config.settings.EMBED_CONCURRENCY, thread_name_prefix="embed"
+        )
+    return _embed_executor
+
+
+def nova_embed_texts(texts: list[str], dimension: int = 1024) -> list[list[float]]:
+    """
+    Embed several texts concurrently, preserving input order.
+
+    botocore releases the GIL while waiting on the HTTP response, so the
+    Bedrock round trips overlap instead of running back to back.
+    """
+    if not texts:
+        return []
+    if len(texts) == 1:
+        return [nova_embed_text(texts[0], dimension)]
+    return list(_get_embed_executor().map(partial(nova_embed_text, dimension=dimension), texts))
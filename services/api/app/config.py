@@ -1,113 +1,167 @@
 import os
-from dataclasses import dataclass
+from collections.abc import Mapping
+from dataclasses import dataclass, field
 from pathlib import Path
 
 from dotenv import load_dotenv
 
 # ------------------------------------------------------------
-# Load .env reliably (works no matter where you run uvicorn from)
+# .env location (works no matter where you run uvicorn from)
 # services/api/app/config.py -> parents[1] == services/api
 # ------------------------------------------------------------
 BASE_DIR = Path(__file__).resolve().parents[1]  # -> .../services/api
-load_dotenv(dotenv_path=BASE_DIR / ".env", override=False)
 
 
-def _env(key: str, default: str | None = None) -> str | None:
+def _env(env: Mapping[str, str], key: str, default: str | None = None) -> str | None:
     """
     Read an environment variable and treat empty strings as missing.
     """
-    v = os.getenv(key)
+    v = env.get(key)
     return v if v not in (None, "") else default
 
 
-def _env_bool(key: str, default: bool = False) -> bool:
+def _env_bool(env: Mapping[str, str], key: str, default: bool = False) -> bool:
     """
     Parse a boolean env var (1/true/yes/on).
     """
-    v = (_env(key) or "").strip().lower()
+    v = (_env(env, key) or "").strip().lower()
     if not v:
         return default
     return v in ("1", "true", "yes", "on")
 
 
-@dataclass(frozen=True)
+# slots=True without frozen: attribute reads are plain slot loads and there is no
+# frozen __setattr__ guard. The module-level settings instance is treated as read-only.
+@dataclass(slots=True)
 class Settings:
     # ---- Provider selection ----
     # bedrock: real AWS Bedrock (Titan embeddings + Nova planner)
     # mock: no AWS required, deterministic behavior for demos
-    NOVA_PROVIDER: str = (_env("NOVA_PROVIDER", "bedrock") or "bedrock").strip().lower()
+    NOVA_PROVIDER: str
 
     # ---- AWS / Bedrock ----
-    AWS_REGION: str = _env("AWS_REGION", _env("AWS_DEFAULT_REGION", "eu-north-1")) or "eu-north-1"
-    AWS_DEFAULT_REGION: str = _env("AWS_DEFAULT_REGION", "eu-north-1") or "eu-north-1"
+    AWS_REGION: str
+    AWS_DEFAULT_REGION: str
 
     # If set, prefer it for the Bedrock runtime client region.
-    BEDROCK_REGION: str = _env("BEDROCK_REGION") or (
-        _env("AWS_REGION") or _env("AWS_DEFAULT_REGION") or "eu-north-1"
-    )
+    BEDROCK_REGION: str
 
-    AWS_PROFILE: str | None = _env("AWS_PROFILE")
-    AWS_SDK_LOAD_CONFIG: str = _env("AWS_SDK_LOAD_CONFIG", "1") or "1"
+    AWS_PROFILE: str | None
+    AWS_SDK_LOAD_CONFIG: str
 
     # ---- Bedrock model IDs ----
     # Embeddings: Titan (RAG retrieval)
-    NOVA_EMBED_MODEL_ID: str = _env(
-        "NOVA_EMBED_MODEL_ID", "amazon.titan-embed-text-v2:0"
-    ) or "amazon.titan-embed-text-v2:0"
+    NOVA_EMBED_MODEL_ID: str
 
     # Planner: Nova 2 Lite (reasoning + plan)
-    NOVA_LITE_MODEL_ID: str = _env(
-        "NOVA_LITE_MODEL_ID", "amazon.nova-2-lite-v1:0"
-    ) or "amazon.nova-2-lite-v1:0"
+    NOVA_LITE_MODEL_ID: str
 
     # Optional: inference profile ARN/ID for Nova if required by your account/region.
-    NOVA_INFERENCE_PROFILE_ID: str | None = _env("NOVA_INFERENCE_PROFILE_ID")
+    NOVA_INFERENCE_PROFILE_ID: str | None
+
+    # Max Bedrock embedding calls in flight for one /brandkit/index batch.
+    EMBED_CONCURRENCY: int
 
     # ---- Database URLs (common aliases) ----
-    DATABASE_URL: str | None = _env("DATABASE_URL")
-    DB_URL: str | None = _env("DB_URL")
-    SQLALCHEMY_DATABASE_URI: str | None = _env("SQLALCHEMY_DATABASE_URI")
+    DATABASE_URL: str | None
+    DB_URL: str | None
+    SQLALCHEMY_DATABASE_URI: str | None
+
+    # ---- Database connection pool (per API process) ----
+    DB_POOL_SIZE: int
+    DB_MAX_OVERFLOW: int
+    # Connections opened at startup so early requests skip connect/auth latency.
+    DB_POOL_MIN: int
 
     # ---- Demo / misc ----
-    DEMO_STARTING_URL: str = _env(
-        "DEMO_STARTING_URL", "https://the-internet.herokuapp.com/"
-    ) or "https://the-internet.herokuapp.com/"
+    DEMO_STARTING_URL: str
+
+    PLAYWRIGHT_HEADLESS: bool
+
+    # Optional fixed pause before each UI step (locator actions already auto-wait).
+    PLAYWRIGHT_PRE_STEP_DELAY_MS: int
+
+    # Browser worker threads shared by all runs (each run sticks to one of them).
+    UI_POOL_SIZE: int
 
-    PLAYWRIGHT_HEADLESS: bool = _env_bool("PLAYWRIGHT_HEADLESS", default=True)
+    # Close a run's browser context after this long without a step.
+    UI_SESSION_TTL_SECONDS: int
 
     # ---- Starting URL policy ----
     # demo: always use DEMO_STARTING_URL
     # plan: use planner's starting_url only if host is in allowlist
     # any_public: accept any public http/https URL (blocks localhost/private IPs in server logic)
-    STARTING_URL_MODE: str = (_env("STARTING_URL_MODE", "demo") or "demo").strip().lower()
+    STARTING_URL_MODE: str
 
     # Comma-separated allowlist of hostnames (used when STARTING_URL_MODE=plan)
-    ALLOWED_STARTING_HOSTS: str = _env(
-        "ALLOWED_STARTING_HOSTS",
-        "the-internet.herokuapp.com",
-    ) or "the-internet.herokuapp.com"
+    ALLOWED_STARTING_HOSTS: str
 
     # ---- Optional DNS SSRF protection ----
     # If enabled, hostnames will be DNS-resolved and blocked if they resolve to private/loopback/link-local IPs.
-    ENABLE_DNS_SSRF_PROTECTION: bool = _env_bool("ENABLE_DNS_SSRF_PROTECTION", default=False)
+    ENABLE_DNS_SSRF_PROTECTION: bool
 
     # DNS resolve timeout (seconds)
-    DNS_RESOLVE_TIMEOUT_S: float = float(_env("DNS_RESOLVE_TIMEOUT_S", "1.5") or "1.5")
-
-    @property
-    def ALLOWED_STARTING_HOSTS_LIST(self) -> list[str]:
-        return [h.strip().lower() for h in (self.ALLOWED_STARTING_HOSTS or "").split(",") if h.strip()]
+    DNS_RESOLVE_TIMEOUT_S: float
 
     # ---- CORS ----
-    CORS_ORIGINS: str = _env("CORS_ORIGINS", "http://localhost:3000") or "http://localhost:3000"
-
-    @property
-    def CORS_ORIGINS_LIST(self) -> list[str]:
-        return [o.strip() for o in (self.CORS_ORIGINS or "").split(",") if o.strip()]
-
-    @property
-    def EFFECTIVE_DATABASE_URL(self) -> str | None:
-        return self.DATABASE_URL or self.DB_URL or self.SQLALCHEMY_DATABASE_URI
+    CORS_ORIGINS: str
+
+    # ---- Derived (parsed once in __post_init__) ----
+    ALLOWED_STARTING_HOSTS_LIST: list[str] = field(init=False, repr=False, compare=False)
+    ALLOWED_STARTING_HOSTS_SET: frozenset[str] = field(init=False, repr=False, compare=False)
+    CORS_ORIGINS_LIST: list[str] = field(init=False, repr=False, compare=False)
+    EFFECTIVE_DATABASE_URL: str | None = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        hosts = [h.strip().lower() for h in (self.ALLOWED_STARTING_HOSTS or "").split(",") if h.strip()]
+        self.ALLOWED_STARTING_HOSTS_LIST = hosts
+        self.ALLOWED_STARTING_HOSTS_SET = frozenset(hosts)
+        self.CORS_ORIGINS_LIST = [o.strip() for o in (self.CORS_ORIGINS or "").split(",") if o.strip()]
+        self.EFFECTIVE_DATABASE_URL = self.DATABASE_URL or self.DB_URL or self.SQLALCHEMY_DATABASE_URI
+
+    @classmethod
+    def from_env(cls, environ: Mapping[str, str] | None = None) -> "Settings":
+        """
+        Build settings from a single snapshot of the environment.
+        Each variable is read once; region fallbacks reuse the resolved values.
+        """
+        env = dict(os.environ if environ is None else environ)
+
+        aws_default_region = _env(env, "AWS_DEFAULT_REGION", "eu-north-1") or "eu-north-1"
+        aws_region = _env(env, "AWS_REGION") or aws_default_region
+
+        return cls(
+            NOVA_PROVIDER=(_env(env, "NOVA_PROVIDER", "bedrock") or "bedrock").strip().lower(),
+            AWS_REGION=aws_region,
+            AWS_DEFAULT_REGION=aws_default_region,
+            BEDROCK_REGION=_env(env, "BEDROCK_REGION") or aws_region,
+            AWS_PROFILE=_env(env, "AWS_PROFILE"),
+            AWS_SDK_LOAD_CONFIG=_env(env, "AWS_SDK_LOAD_CONFIG", "1") or "1",
+            NOVA_EMBED_MODEL_ID=_env(env, "NOVA_EMBED_MODEL_ID", "amazon.titan-embed-text-v2:0")
+            or "amazon.titan-embed-text-v2:0",
+            NOVA_LITE_MODEL_ID=_env(env, "NOVA_LITE_MODEL_ID", "amazon.nova-2-lite-v1:0")
+            or "amazon.nova-2-lite-v1:0",
+            NOVA_INFERENCE_PROFILE_ID=_env(env, "NOVA_INFERENCE_PROFILE_ID"),
+            EMBED_CONCURRENCY=int(_env(env, "EMBED_CONCURRENCY", "8") or "8"),
+            DATABASE_URL=_env(env, "DATABASE_URL"),
+            DB_URL=_env(env, "DB_URL"),
+            SQLALCHEMY_DATABASE_URI=_env(env, "SQLALCHEMY_DATABASE_URI"),
+            DB_POOL_SIZE=int(_env(env, "DB_POOL_SIZE", "20") or "20"),
+            DB_MAX_OVERFLOW=int(_env(env, "DB_MAX_OVERFLOW", "20") or "20"),
+            DB_POOL_MIN=int(_env(env, "DB_POOL_MIN", "5") or "5"),
+            DEMO_STARTING_URL=_env(env, "DEMO_STARTING_URL", "https://the-internet.herokuapp.com/")
+            or "https://the-internet.herokuapp.com/",
+            PLAYWRIGHT_HEADLESS=_env_bool(env, "PLAYWRIGHT_HEADLESS", default=True),
+            PLAYWRIGHT_PRE_STEP_DELAY_MS=int(_env(env, "PLAYWRIGHT_PRE_STEP_DELAY_MS", "0") or "0"),
+            UI_POOL_SIZE=int(_env(env, "UI_POOL_SIZE", "4") or "4"),
+            UI_SESSION_TTL_SECONDS=int(_env(env, "UI_SESSION_TTL_SECONDS", "600") or "600"),
+            STARTING_URL_MODE=(_env(env, "STARTING_URL_MODE", "demo") or "demo").strip().lower(),
+            ALLOWED_STARTING_HOSTS=_env(env, "ALLOWED_STARTING_HOSTS", "the-internet.herokuapp.com")
+            or "the-internet.herokuapp.com",
+            ENABLE_DNS_SSRF_PROTECTION=_env_bool(env, "ENABLE_DNS_SSRF_PROTECTION", default=False),
+            DNS_RESOLVE_TIMEOUT_S=float(_env(env, "DNS_RESOLVE_TIMEOUT_S", "1.5") or "1.5"),
+            CORS_ORIGINS=_env(env, "CORS_ORIGINS", "http://localhost:3000") or "http://localhost:3000",
+        )
 
     def validate(self) -> None:
         if self.NOVA_PROVIDER not in ("bedrock", "mock"):
@@ -116,6 +170,27 @@ class Settings:
         if not self.EFFECTIVE_DATABASE_URL:
             raise RuntimeError("DATABASE_URL is not configured. Set DATABASE_URL to a PostgreSQL asyncpg URL.")
 
+        if self.DB_POOL_SIZE <= 0:
+            raise RuntimeError("DB_POOL_SIZE must be > 0.")
+
+        if self.DB_MAX_OVERFLOW < 0:
+            raise RuntimeError("DB_MAX_OVERFLOW must be >= 0.")
+
+        if not 0 <= self.DB_POOL_MIN <= self.DB_POOL_SIZE:
+            raise RuntimeError("DB_POOL_MIN must be between 0 and DB_POOL_SIZE.")
+
+        if self.EMBED_CONCURRENCY <= 0:
+            raise RuntimeError("EMBED_CONCURRENCY must be > 0.")
+
+        if self.PLAYWRIGHT_PRE_STEP_DELAY_MS < 0:
+            raise RuntimeError("PLAYWRIGHT_PRE_STEP_DELAY_MS must be >= 0.")
+
+        if self.UI_POOL_SIZE <= 0:
+            raise RuntimeError("UI_POOL_SIZE must be > 0.")
+
+        if self.UI_SESSION_TTL_SECONDS <= 0:
+            raise RuntimeError("UI_SESSION_TTL_SECONDS must be > 0.")
+
         if self.STARTING_URL_MODE not in ("demo", "plan", "any_public"):
             raise RuntimeError("STARTING_URL_MODE must be one of: demo, plan, any_public.")
 
@@ -134,10 +209,40 @@ class Settings:
                 raise RuntimeError("NOVA_LITE_MODEL_ID (or NOVA_INFERENCE_PROFILE_ID) is not configured.")
 
 
-settings = Settings()
+_settings: Settings | None = None
+_DOTENV_LOADED_ENV = "_NOVAFLOW_DOTENV_LOADED"
 
-# Ensure boto3 loads AWS config/credentials from shared config files (required for many SSO setups).
-os.environ.setdefault("AWS_SDK_LOAD_CONFIG", settings.AWS_SDK_LOAD_CONFIG)
-os.environ.setdefault("AWS_REGION", settings.AWS_REGION)
-os.environ.setdefault("AWS_DEFAULT_REGION", settings.AWS_DEFAULT_REGION)
-os.environ.setdefault("BEDROCK_REGION", settings.BEDROCK_REGION)
\ No newline at end of file
+
+def init_config() -> Settings:
+    """
+    Load .env, build Settings and export AWS defaults for boto3.
+
+    Called once by the app entrypoint (main.py). Importing this module has no
+    side effects; `settings` is resolved lazily through init_config() on first use.
+    Other app modules read `config.settings` inside functions, so importing them
+    doesn't load config either.
+    """
+    global _settings
+    if _settings is not None:
+        return _settings
+
+    # The marker survives module re-imports (tests, importlib.reload) and is inherited
+    # by child processes, so .env is parsed once; values never override os.environ anyway.
+    if not os.environ.get(_DOTENV_LOADED_ENV):
+        load_dotenv(dotenv_path=BASE_DIR / ".env", override=False)
+        os.environ[_DOTENV_LOADED_ENV] = "1"
+    _settings = Settings.from_env()
+
+    # Ensure boto3 loads AWS config/credentials from shared config files (required for many SSO setups).
+    os.environ.setdefault("AWS_SDK_LOAD_CONFIG", _settings.AWS_SDK_LOAD_CONFIG)
+    os.environ.setdefault("AWS_REGION", _settings.AWS_REGION)
+    os.environ.setdefault("AWS_DEFAULT_REGION", _settings.AWS_DEFAULT_REGION)
+    os.environ.setdefault("BEDROCK_REGION", _settings.BEDROCK_REGION)
+    return _settings
+
+
+def __getattr__(name: str):
+    # Keeps `from .config import settings` working without import-time I/O.
+    if name == "settings":
+        return init_config()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,14 +1,66 @@
 from __future__ import annotations
 
+import asyncio
+
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlmodel import SQLModel
 from sqlmodel.ext.asyncio.session import AsyncSession
 
-from .config import settings
+from . import config
 
 engine = None
 SessionLocal: async_sessionmaker[AsyncSession] | None = None
 
+# create_all() only creates missing tables. Columns changed after a table
+# first shipped are applied here so existing databases keep working (idempotent).
+_SCHEMA_UPGRADES = (
+    "ALTER TABLE branddoc ADD COLUMN IF NOT EXISTS embedding_blob BYTEA",
+    "ALTER TABLE branddoc ALTER COLUMN embedding_json DROP NOT NULL",
+    "ALTER TABLE branddoc ADD COLUMN IF NOT EXISTS embedding_scale DOUBLE PRECISION",
+    "CREATE INDEX IF NOT EXISTS ix_runlog_run_ts_id ON runlog (run_id, ts, id)",
+    "DROP INDEX IF EXISTS ix_runlog_run_id",  # superseded by ix_runlog_run_ts_id
+    "DROP INDEX IF EXISTS ix_runlog_run_ts",  # superseded by ix_runlog_run_ts_id
+    "CREATE INDEX IF NOT EXISTS ix_run_updated_at ON run (updated_at)",
+    *(
+        # Naive UTC timestamps -> timestamptz (guarded: the USING clause is not idempotent)
+        f"""
+        DO $$ BEGIN
+            IF (SELECT data_type FROM information_schema.columns
+                WHERE table_name = '{table}' AND column_name = '{column}') = 'timestamp without time zone' THEN
+                ALTER TABLE {table} ALTER COLUMN {column} TYPE TIMESTAMPTZ USING {column} AT TIME ZONE 'UTC';
+            END IF;
+        END $$
+        """
+        for table, column in (
+            ("branddoc", "created_at"),
+            ("run", "created_at"),
+            ("run", "updated_at"),
+            ("runlog", "ts"),
+        )
+    ),
+    "ALTER TABLE run ALTER COLUMN updated_at SET DEFAULT now()",
+    # Runs mid-flight at upgrade time resume where they stopped: the cursor is backfilled
+    # (only when the column is first added) from the steps their logs record as executed.
+    """
+    DO $$ BEGIN
+        IF NOT EXISTS (SELECT 1 FROM information_schema.columns
+                       WHERE table_name = 'run' AND column_name = 'next_step_index') THEN
+            ALTER TABLE run ADD COLUMN next_step_index INTEGER NOT NULL DEFAULT 0;
+            UPDATE run SET next_step_index = done.n
+            FROM (
+                SELECT run_id, COUNT(DISTINCT data_json::json->>'step_id') AS n
+                FROM runlog
+                WHERE message = 'UI step executed'
+                GROUP BY run_id
+            ) AS done
+            WHERE run.id = done.run_id;
+        END IF;
+    END $$
+    """,
+    "ALTER TABLE run DROP COLUMN IF EXISTS executed_step_ids",  # superseded by next_step_index
+)
+
 
 async def init_db() -> None:
     """
@@ -18,14 +70,24 @@ async def init_db() -> None:
     """
     global engine, SessionLocal
 
-    db_url = settings.EFFECTIVE_DATABASE_URL
+    db_url = config.settings.EFFECTIVE_DATABASE_URL
     if not db_url:
         raise RuntimeError("DATABASE_URL is not configured. Set DATABASE_URL to a PostgreSQL asyncpg URL.")
 
+    # Plain postgres URLs would pick the sync psycopg2 driver; force asyncpg.
+    for prefix in ("postgresql://", "postgres://"):
+        if db_url.startswith(prefix):
+            db_url = "postgresql+asyncpg://" + db_url[len(prefix):]
+            break
+
     if engine is None:
+        # SQLAlchemy picks AsyncAdaptedQueuePool for async engines; don't override poolclass.
         engine = create_async_engine(
             db_url,
             echo=False,
+            pool_size=config.settings.DB_POOL_SIZE,
+            max_overflow=config.settings.DB_MAX_OVERFLOW,
+            pool_recycle=1800,  # Recycle connections older than 30 min
             pool_pre_ping=True,  # Helps avoid stale connections
         )
 
@@ -41,6 +103,21 @@ async def init_db() -> None:
 
     async with engine.begin() as conn:
         await conn.run_sync(SQLModel.metadata.create_all)
+        for stmt in _SCHEMA_UPGRADES:
+            await conn.execute(text(stmt))
+
+    await _warm_pool(config.settings.DB_POOL_MIN)
+
+
+async def _warm_pool(size: int) -> None:
+    """
+    Open `size` pool connections in parallel and return them to the pool,
+    so the first requests don't each pay connect + auth round trips.
+    """
+    if size <= 0:
+        return
+    conns = await asyncio.gather(*(engine.connect() for _ in range(size)))
+    await asyncio.gather(*(c.close() for c in conns))
 
 
 async def get_session():
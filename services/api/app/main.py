@@ -3,31 +3,48 @@ import traceback
 import asyncio
 import re
 import ipaddress
+from collections import OrderedDict
 from urllib.parse import urlparse
-from datetime import datetime
-from typing import Optional, Set, Dict
-from functools import partial
+from datetime import datetime, timezone
+from typing import Optional, Dict
+from functools import lru_cache, partial
 from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import anyio
-from fastapi import FastAPI, Depends, HTTPException
+import orjson
+from fastapi import FastAPI, BackgroundTasks, Depends, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel, Field
+from sqlalchemy import func, insert, tuple_, update
 from sqlmodel import select
 from sqlmodel.ext.asyncio.session import AsyncSession
 
+from .config import init_config
+
+# Load .env before any app module reads settings.
+init_config()
+
 from .db import init_db, get_session
 from .models import BrandDoc, Run, RunLog
-from .bedrock import nova_embed_text, nova_plan_with_lite
-from .rag import top_k
+from .bedrock import nova_embed_text, nova_embed_texts, nova_plan_with_lite
+from .rag import DocIndex, embedding_from_row, embedding_to_bytes
 from .planner import PLANNER_SYSTEM, build_planner_user_prompt
-from .runner import run_one_step_stateful, close_session
+from .runner import (
+    run_one_step_stateful,
+    run_steps_stateful,
+    close_session,
+    flush_artifacts,
+    shutdown_browser,
+    take_artifact_errors,
+)
 from .config import settings
 from .url_utils import sanitize_http_url
 
-app = FastAPI(title="NovaFlow Ops API", version="0.2.0")
+# orjson renders every route's response (run logs, plans) instead of stdlib json.
+app = FastAPI(title="NovaFlow Ops API", version="0.2.0", default_response_class=ORJSONResponse)
 
 # --- Serve artifacts (screenshots, etc.) ---
 ARTIFACTS_DIR = Path(__file__).resolve().parents[1] / "artifacts"
@@ -42,94 +59,235 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# One dedicated single-thread executor per run_id (keeps Playwright session thread-safe)
-_UI_EXECUTORS: Dict[int, ThreadPoolExecutor] = {}
+# Fixed set of single-thread executors; a run always maps to pools[run_id % N], so its
+# Playwright session (thread-bound) is only ever touched from one thread. Sessions are
+# closed when the run is DONE, on close-ui-session, or once idle for UI_SESSION_TTL_SECONDS.
+_UI_POOLS: list[ThreadPoolExecutor] = []
+_UI_LAST_USED: Dict[int, float] = {}
+_UI_SWEEP_INTERVAL_S = 60
+_ui_sweeper: Optional[asyncio.Task] = None
+
+# Parsed plans (+ indices of their ui steps) keyed by (run_id, created_at). plan_json is
+# written once, when planning finishes, so the key identifies its content; PLANNING
+# runs are never cached. Cached values are shared: read-only.
+_PLAN_CACHE: "OrderedDict[tuple[int, datetime], tuple[dict, tuple[int, ...]]]" = OrderedDict()
+_PLAN_CACHE_MAX = 512
+
+# BrandDoc embeddings (ids + matrix) for retrieval: loaded at startup, appended by
+# /brandkit/index, reloaded by /task when the table no longer matches its fingerprint.
+_DOC_INDEX = DocIndex(dim=1024)
 
 
 @app.on_event("startup")
 async def on_startup():
+    started = datetime.now(timezone.utc)
     settings.validate()
     await init_db()
+    async for session in get_session():
+        await _fail_interrupted_planning(session, started)
+        await _load_doc_index(session)
+    await asyncio.to_thread(_DOC_INDEX.warmup)
+
+    _UI_POOLS[:] = [
+        ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"ui-pool-{i}")
+        for i in range(settings.UI_POOL_SIZE)
+    ]
+
+    global _ui_sweeper
+    _ui_sweeper = asyncio.create_task(_sweep_idle_ui_sessions())
 
 
 @app.on_event("shutdown")
 async def on_shutdown():
-    for run_id in list(_UI_EXECUTORS.keys()):
-        try:
-            close_session(run_id)
-        except Exception:
-            pass
+    if _ui_sweeper is not None:
+        _ui_sweeper.cancel()
+
+    await asyncio.gather(*(_release_ui(run_id) for run_id in list(_UI_LAST_USED)), return_exceptions=True)
+    # Each pool thread owns a browser; close them on their own threads.
+    await asyncio.gather(
+        *(asyncio.wait_for(asyncio.wrap_future(ex.submit(shutdown_browser)), 30) for ex in _UI_POOLS),
+        return_exceptions=True,
+    )
 
-    for ex in _UI_EXECUTORS.values():
-        try:
-            ex.shutdown(wait=False, cancel_futures=True)
-        except Exception:
-            pass
+    for ex in _UI_POOLS:
+        ex.shutdown(wait=False, cancel_futures=True)
+    _UI_POOLS.clear()
+
+    await asyncio.to_thread(flush_artifacts)
+
+
+def _dumps(obj) -> str:
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+
+
+def _loads(s: str | bytes):
+    return orjson.loads(s)
+
+
+def add_log(
+    session: AsyncSession,
+    run_id: int,
+    level: str,
+    message: str,
+    data: dict | None = None,
+    ts: datetime | None = None,
+):
+    # Pass `ts` to reuse a timestamp already taken for the request. Logs may share a
+    # ts; get_run pages on (ts, id), so equal timestamps are never skipped.
+    session.add(
+        RunLog(
+            run_id=run_id,
+            level=level,
+            message=message,
+            data_json=_dumps(data or {}),
+            ts=ts or datetime.now(timezone.utc),
+        )
+    )
+
+
+def _load_plan_entry(run) -> tuple[dict, tuple[int, ...]]:
+    # `run` is a Run or a Row with id, status, created_at and plan_json.
+    if run.status == "PLANNING":
+        return {}, ()
 
-    _UI_EXECUTORS.clear()
+    key = (run.id, run.created_at)
+    entry = _PLAN_CACHE.get(key)
+    if entry is not None:
+        _PLAN_CACHE.move_to_end(key)
+        return entry
 
+    plan = _loads(run.plan_json)
+    ui_indices = tuple(i for i, s in enumerate(plan.get("steps", [])) if s.get("type") == "ui")
+    entry = _PLAN_CACHE[key] = (plan, ui_indices)
+    if len(_PLAN_CACHE) > _PLAN_CACHE_MAX:
+        _PLAN_CACHE.popitem(last=False)
+    return entry
 
-def add_log(session: AsyncSession, run_id: int, level: str, message: str, data: dict | None = None):
-    session.add(RunLog(run_id=run_id, level=level, message=message, data_json=json.dumps(data or {})))
+
+def _load_plan(run) -> dict:
+    return _load_plan_entry(run)[0]
+
+
+async def _load_doc_index(session: AsyncSession) -> None:
+    rows = (
+        await session.exec(
+            select(BrandDoc.id, BrandDoc.embedding_blob, BrandDoc.embedding_json, BrandDoc.embedding_scale)
+        )
+    ).all()
+    _DOC_INDEX.clear()
+    _DOC_INDEX.add([(r[0], embedding_from_row(r[1], r[2], r[3])) for r in rows])
 
 
 def _get_executor(run_id: int) -> ThreadPoolExecutor:
-    ex = _UI_EXECUTORS.get(run_id)
-    if ex is None:
-        ex = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"ui-run-{run_id}")
-        _UI_EXECUTORS[run_id] = ex
-    return ex
+    return _UI_POOLS[run_id % len(_UI_POOLS)]
 
 
 async def _run_ui_in_executor(run_id: int, fn, *args, timeout_seconds: int = 90):
     loop = asyncio.get_running_loop()
     ex = _get_executor(run_id)
 
-    with anyio.fail_after(timeout_seconds):
-        return await loop.run_in_executor(ex, partial(fn, *args))
+    _UI_LAST_USED[run_id] = loop.time()
+    try:
+        with anyio.fail_after(timeout_seconds):
+            return await loop.run_in_executor(ex, partial(fn, *args))
+    finally:
+        _UI_LAST_USED[run_id] = loop.time()
 
 
-def _strip_markdown_code_fences(text: str) -> str:
-    s = (text or "").strip()
-    s = re.sub(r"^\s*```(?:json|JSON)?\s*", "", s)
-    s = re.sub(r"\s*```\s*$", "", s)
-    return s.strip()
+async def _release_ui(run_id: int) -> bool:
+    """
+    Close the run's browser session on the pool thread that owns it (sync Playwright
+    objects can't be closed from any other thread). Returns False if the close failed;
+    the run then stays tracked so the idle sweeper retries it.
+    """
+    if run_id not in _UI_LAST_USED:
+        return True  # no step ran for it in this process, so it has no session
+
+    try:
+        await _run_ui_in_executor(run_id, close_session, run_id, timeout_seconds=30)
+    except Exception:
+        return False
+
+    _UI_LAST_USED.pop(run_id, None)
+    return True
+
+
+async def _sweep_idle_ui_sessions() -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(min(_UI_SWEEP_INTERVAL_S, settings.UI_SESSION_TTL_SECONDS))
+        cutoff = loop.time() - settings.UI_SESSION_TTL_SECONDS
+        for run_id in [r for r, ts in _UI_LAST_USED.items() if ts < cutoff]:
+            await _release_ui(run_id)
+
+
+_JSON_STRUCTURE_RE = re.compile(r'[{}"\\]')
 
 
 def _extract_json_object(text: str) -> str:
+    """
+    Return the first balanced {...} object in `text` (e.g. inside markdown fences or
+    surrounded by prose). One pass over the structural characters, skipping braces
+    inside strings; falls back to first '{' .. last '}' if it never closes.
+    """
     s = (text or "").strip()
     start = s.find("{")
-    end = s.rfind("}")
-    if start == -1 or end == -1 or end <= start:
+    if start == -1:
         return s
-    return s[start : end + 1]
+
+    depth = 0
+    in_string = False
+    escaped_at = -1
+    for m in _JSON_STRUCTURE_RE.finditer(s, start):
+        i = m.start()
+        if i == escaped_at:
+            continue
+        c = m.group()
+        if in_string:
+            if c == "\\":
+                escaped_at = i + 1
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = True
+        elif c == "{":
+            depth += 1
+        elif c == "}":
+            depth -= 1
+            if depth == 0:
+                return s[start : i + 1]
+
+    end = s.rfind("}")
+    return s[start : end + 1] if end > start else s
+
+
+# Plans are a few KB; anything near this is a runaway generation, not a plan.
+_MAX_PLAN_BYTES = 256 * 1024
 
 
 def _parse_planner_json(plan_text: str) -> dict:
     raw = (plan_text or "").strip()
+    # UTF-8 is at most 4 bytes/char, so only long outputs need encoding to measure.
+    if len(raw) * 4 > _MAX_PLAN_BYTES and len(raw.encode()) > _MAX_PLAN_BYTES:
+        raise HTTPException(413, f"Planner output too large ({len(raw.encode())} bytes, max {_MAX_PLAN_BYTES}).")
 
-    try:
-        obj = json.loads(raw)
-        if isinstance(obj, dict):
-            return obj
-    except Exception:
-        pass
-
-    cleaned = _strip_markdown_code_fences(raw)
-    try:
-        obj = json.loads(cleaned)
-        if isinstance(obj, dict):
-            return obj
-    except Exception:
-        pass
+    # Common case: the model returned bare JSON. Fallbacks below use stdlib json,
+    # which also tolerates NaN/Infinity that orjson rejects.
+    if raw.startswith("{") and raw.endswith("}"):
+        try:
+            obj = orjson.loads(raw)
+            if isinstance(obj, dict):
+                return obj
+        except orjson.JSONDecodeError:
+            pass
 
-    extracted = _extract_json_object(cleaned)
+    extracted = _extract_json_object(raw)
     try:
         obj = json.loads(extracted)
         if isinstance(obj, dict):
             return obj
     except Exception as e:
-        preview = raw[:500].replace("\n", "\\n")
+        preview = raw.encode()[:500].decode(errors="ignore").replace("\n", "\\n")
         raise HTTPException(500, f"Planner returned invalid JSON. Raw preview: {preview}") from e
 
     raise HTTPException(500, "Planner returned JSON but not an object/dict.")
@@ -138,6 +296,7 @@ def _parse_planner_json(plan_text: str) -> dict:
 # -----------------------------
 # Starting URL selection (FIX + SSRF hygiene)
 # -----------------------------
+@lru_cache(maxsize=2048)
 def _is_blocked_host(host: str) -> bool:
     """
     Block localhost + private/loopback IPs.
@@ -166,17 +325,30 @@ def _choose_starting_url(plan_starting_url: str | None) -> str:
 
     Always returns a safe http/https URL (fallbacks if invalid).
     """
-    mode = (settings.STARTING_URL_MODE or "demo").strip().lower()
+    return _choose_starting_url_cached(
+        plan_starting_url or "",
+        settings.STARTING_URL_MODE,
+        settings.DEMO_STARTING_URL,
+        settings.ALLOWED_STARTING_HOSTS_SET,
+    )
+
+
+# Pure function of its arguments; called for every /task and every executed step.
+@lru_cache(maxsize=2048)
+def _choose_starting_url_cached(
+    plan_starting_url: str, starting_url_mode: str, demo_starting_url: str, allowed_hosts: frozenset[str]
+) -> str:
+    mode = (starting_url_mode or "demo").strip().lower()
 
     demo_fallback = (
-        sanitize_http_url(settings.DEMO_STARTING_URL)
+        sanitize_http_url(demo_starting_url)
         or "https://the-internet.herokuapp.com/"
     )
 
     if mode == "demo":
         return demo_fallback
 
-    safe_plan_url = sanitize_http_url(plan_starting_url or "")
+    safe_plan_url = sanitize_http_url(plan_starting_url)
     if not safe_plan_url:
         return demo_fallback
 
@@ -188,8 +360,7 @@ def _choose_starting_url(plan_starting_url: str | None) -> str:
         return safe_plan_url
 
     if mode == "plan":
-        allowed = set(settings.ALLOWED_STARTING_HOSTS_LIST)
-        return safe_plan_url if host in allowed else demo_fallback
+        return safe_plan_url if host in allowed_hosts else demo_fallback
 
     return demo_fallback
 
@@ -208,6 +379,8 @@ _ALLOWED_DSL_PREFIXES = (
     "WAIT_MS:",
     "SCREENSHOT:",
 )
+# Keyword before the first ':' -> one hash lookup instead of a prefix scan per step
+_ALLOWED_DSL_KEYWORDS = frozenset(p[:-1] for p in _ALLOWED_DSL_PREFIXES)
 
 
 def _validate_plan(plan: dict) -> None:
@@ -224,7 +397,12 @@ def _validate_plan(plan: dict) -> None:
             instr = (s.get("instruction") or "").strip()
             if not instr:
                 raise HTTPException(500, f"Planner UI step #{i} has empty instruction.")
-            if not any(instr.upper().startswith(p) for p in _ALLOWED_DSL_PREFIXES):
+            # Planner output is normally upper-case already: try the exact keyword
+            # before paying for .upper() (only the keyword is ever uppercased).
+            keyword, sep, _ = instr.partition(":")
+            if not sep or (
+                keyword not in _ALLOWED_DSL_KEYWORDS and keyword.upper() not in _ALLOWED_DSL_KEYWORDS
+            ):
                 raise HTTPException(
                     500,
                     f"Planner UI step #{i} instruction not in Runner DSL: '{instr}'"
@@ -286,107 +464,222 @@ async def health():
 
 @app.post("/brandkit/index")
 async def brandkit_index(payload: BrandKitIndexIn, session: AsyncSession = Depends(get_session)):
-    count = 0
-    for d in payload.docs:
-        vec = await anyio.to_thread.run_sync(nova_embed_text, d.content, payload.embedding_dimension)
-        session.add(
-            BrandDoc(
-                title=d.title,
-                source=d.source,
-                content=d.content,
-                tags=",".join(d.tags),
-                embedding_json=json.dumps(vec),
+    # One thread hop for the whole batch; nova_embed_texts overlaps the Bedrock calls.
+    vecs = await anyio.to_thread.run_sync(
+        nova_embed_texts, [d.content for d in payload.docs], payload.embedding_dimension
+    )
+    # Core executemany insert: no ORM instances or unit-of-work bookkeeping per doc.
+    now = datetime.now(timezone.utc)
+    rows = []
+    for d, vec in zip(payload.docs, vecs):
+        blob, scale = embedding_to_bytes(vec)
+        rows.append(
+            {
+                "title": d.title,
+                "source": d.source,
+                "content": d.content,
+                "tags": ",".join(d.tags),
+                "embedding_blob": blob,
+                "embedding_scale": scale,
+                "created_at": now,
+            }
+        )
+    if rows:
+        ids = (
+            await session.exec(
+                insert(BrandDoc).returning(BrandDoc.id, sort_by_parameter_order=True), params=rows
             )
+        ).scalars().all()
+        await session.commit()
+        _DOC_INDEX.add(
+            [
+                (doc_id, embedding_from_row(r["embedding_blob"], None, r["embedding_scale"]))
+                for doc_id, r in zip(ids, rows)
+            ]
         )
-        count += 1
+    return {"ok": True, "indexed": len(vecs)}
+
+
+async def _build_plan(session: AsyncSession, task: str, top_k: int) -> tuple[dict, list[dict]]:
+    qvec = await anyio.to_thread.run_sync(nova_embed_text, task, 1024)
+
+    # Rank in memory, then fetch text for the winners only.
+    # Another worker may have indexed docs since we loaded; rebuild if the table moved.
+    fingerprint = (await session.exec(select(func.count(), func.max(BrandDoc.id)))).one()
+    if tuple(fingerprint) != _DOC_INDEX.fingerprint:
+        await _load_doc_index(session)
+    hits = _DOC_INDEX.top_k(qvec, k=top_k)
+    texts = {}
+    if hits:
+        rows = (
+            await session.exec(
+                select(BrandDoc.id, BrandDoc.title, BrandDoc.content).where(
+                    BrandDoc.id.in_([h[1] for h in hits])
+                )
+            )
+        ).all()
+        texts = {r[0]: (r[1], r[2]) for r in rows}
+    ctx = [
+        {"doc_id": doc_id, "title": texts[doc_id][0], "content": texts[doc_id][1], "score": score}
+        for score, doc_id in hits
+        if doc_id in texts
+    ]
+
+    user_prompt = build_planner_user_prompt(task, ctx)
+    plan_text = await anyio.to_thread.run_sync(
+        partial(nova_plan_with_lite, PLANNER_SYSTEM, user_prompt, cache_system=True)
+    )
+    plan = _parse_planner_json(plan_text)
 
-    await session.commit()
-    return {"ok": True, "indexed": count}
+    # Normalize/sanitize starting_url once, store it in the plan
+    plan["starting_url"] = _choose_starting_url(plan.get("starting_url"))
 
+    # Validate steps so the runner won't crash on weird outputs
+    _validate_plan(plan)
+    return plan, ctx
 
-@app.post("/task")
-async def create_task(payload: TaskIn, session: AsyncSession = Depends(get_session)):
-    qvec = await anyio.to_thread.run_sync(nova_embed_text, payload.task, 1024)
 
-    rows = (await session.exec(select(BrandDoc))).all()
-    docs = [(r.id, r.title, r.content, json.loads(r.embedding_json)) for r in rows]
+async def _fail_interrupted_planning(session: AsyncSession, started: datetime) -> None:
+    # Planning is an in-process background task: runs a previous process left in
+    # PLANNING (crash, kill, --reload) will never move on by themselves.
+    run_ids = (
+        await session.exec(
+            update(Run)
+            .where(Run.status == "PLANNING", Run.created_at < started)
+            .values(status="ERROR")
+            .returning(Run.id)
+        )
+    ).scalars().all()
+    for run_id in run_ids:
+        add_log(session, run_id, "ERROR", "Planning interrupted", {"error": "The API restarted while planning."})
+    await session.commit()
 
-    hits = top_k(qvec, docs, k=payload.top_k)
-    ctx = [{"doc_id": h[1], "title": h[2], "content": h[3], "score": h[0]} for h in hits]
 
-    user_prompt = build_planner_user_prompt(payload.task, ctx)
-    plan_text = await anyio.to_thread.run_sync(nova_plan_with_lite, PLANNER_SYSTEM, user_prompt)
-    plan = _parse_planner_json(plan_text)
+async def _finish_planning(run_id: int, result: tuple[dict, list[dict]] | None, error: dict) -> None:
+    # Fresh session: the planning one may be mid-failure. Plan and its log commit together.
+    async for session in get_session():
+        run = await session.get(Run, run_id)
+        if run is None or run.status != "PLANNING":  # deleted, or failed by a startup sweep
+            continue
+        if result is not None:
+            plan, ctx = result
+            run.plan_json = _dumps(plan)
+            run.status = "PLANNED"
+            add_log(session, run_id, "INFO", "Run created", {"ctx": ctx, "plan": plan})
+        else:
+            run.status = "ERROR"
+            add_log(session, run_id, "ERROR", "Planning failed", error)
+        session.add(run)
+        await session.commit()
 
-    # Normalize/sanitize starting_url once, store it in the plan
-    plan["starting_url"] = _choose_starting_url(plan.get("starting_url"))
 
-    # Validate steps so the runner won't crash on weird outputs
-    _validate_plan(plan)
+async def _plan_pipeline(run_id: int, task: str, top_k: int) -> None:
+    # Runs after /task has responded, so it can't use the request's session.
+    result = None
+    error = {"error": "Planning was interrupted.", "traceback": ""}
+    try:
+        async for session in get_session():
+            result = await _build_plan(session, task, top_k)
+    except Exception as e:
+        error = {
+            "error": e.detail if isinstance(e, HTTPException) else str(e),
+            "traceback": traceback.format_exc(),
+        }
+    finally:
+        # Always move the run out of PLANNING, even if planning raised or was cancelled.
+        await asyncio.shield(_finish_planning(run_id, result, error))
 
-    run = Run(
-        task=payload.task,
-        status="PLANNED",
-        plan_json=json.dumps(plan),
-        created_at=datetime.utcnow(),
-        updated_at=datetime.utcnow(),
-    )
+
+@app.post("/task")
+async def create_task(
+    payload: TaskIn, background_tasks: BackgroundTasks, session: AsyncSession = Depends(get_session)
+):
+    """
+    Create a PLANNING run and plan it in the background. Poll GET /runs/{run_id}
+    until the status moves on: PLANNED (the "Run created" log carries ctx + plan)
+    or ERROR (see the "Planning failed" log).
+    """
+    now = datetime.now(timezone.utc)
+    run = Run(task=payload.task, status="PLANNING", created_at=now)
     session.add(run)
-    await session.commit()
-    await session.refresh(run)
+    await session.flush()  # assigns run.id; run and its first log commit together
 
-    add_log(session, run.id, "INFO", "Run created", {"ctx": ctx, "plan": plan})
+    add_log(session, run.id, "INFO", "Planning started", {"top_k": payload.top_k}, ts=now)
     await session.commit()
 
-    return {"run_id": run.id, "plan": plan, "ctx": ctx}
+    background_tasks.add_task(_plan_pipeline, run.id, payload.task, payload.top_k)
+    return {"run_id": run.id, "status": run.status}
 
 
 @app.get("/runs/{run_id}")
-async def get_run(run_id: int, session: AsyncSession = Depends(get_session)):
-    run = await session.get(Run, run_id)
+async def get_run(
+    run_id: int,
+    since_ts: Optional[datetime] = None,
+    since_id: Optional[int] = None,
+    before: Optional[datetime] = None,
+    before_id: Optional[int] = None,
+    limit: int = Query(200, ge=1, le=2000),
+    session: AsyncSession = Depends(get_session),
+):
+    """
+    Run details plus up to `limit` logs, always returned in (ts, id) order.
+
+    By default these are the newest `limit` logs (pass the oldest log's ts and id as
+    `before` / `before_id` to page further back). Pass the last seen log's ts and id
+    as `since_ts` / `since_id` to fetch the logs after it instead (a short page means
+    you're caught up). Passing both bounds returns the oldest `limit` logs strictly
+    between them. A ts without its id compares on ts alone, which can skip logs that
+    share the boundary timestamp.
+    """
+    if since_id is not None and since_ts is None:
+        raise HTTPException(422, "since_id requires since_ts")
+    if before_id is not None and before is None:
+        raise HTTPException(422, "before_id requires before")
+
+    # Column projections: Row tuples, no Run/RunLog entities in the identity map.
+    # The run Row carries id/created_at/plan_json, which is all _load_plan reads.
+    run = (
+        await session.exec(
+            select(Run.id, Run.task, Run.status, Run.plan_json, Run.created_at).where(Run.id == run_id)
+        )
+    ).first()
     if not run:
         raise HTTPException(404, "Run not found")
 
-    logs = (
-        await session.exec(
-            select(RunLog).where(RunLog.run_id == run_id).order_by(RunLog.ts)
-        )
-    ).all()
+    cursor = tuple_(RunLog.ts, RunLog.id)
+    stmt = select(RunLog.id, RunLog.ts, RunLog.level, RunLog.message, RunLog.data_json).where(
+        RunLog.run_id == run_id
+    )
+    if before is not None:
+        stmt = stmt.where(RunLog.ts < before if before_id is None else cursor < tuple_(before, before_id))
+    if since_ts is not None:
+        stmt = stmt.where(RunLog.ts > since_ts if since_id is None else cursor > tuple_(since_ts, since_id))
+        logs = (await session.exec(stmt.order_by(RunLog.ts, RunLog.id).limit(limit))).all()
+    else:
+        logs = (await session.exec(stmt.order_by(RunLog.ts.desc(), RunLog.id.desc()).limit(limit))).all()
+        logs.reverse()
 
     return {
         "run": {
             "id": run.id,
             "task": run.task,
             "status": run.status,
-            "plan": json.loads(run.plan_json),
+            "plan": _load_plan(run),
         },
         "logs": [
-            {"ts": l.ts, "level": l.level, "message": l.message, "data": json.loads(l.data_json)}
+            {"id": l.id, "ts": l.ts, "level": l.level, "message": l.message, "data": _loads(l.data_json)}
             for l in logs
         ],
     }
 
 
-def _executed_step_ids(logs: list[RunLog]) -> Set[str]:
-    executed: Set[str] = set()
-    for l in logs:
-        if l.message == "UI step executed":
-            try:
-                data = json.loads(l.data_json)
-                sid = data.get("step_id")
-                if sid:
-                    executed.add(sid)
-            except Exception:
-                pass
-    return executed
-
-
-def _pick_next_ui_step(plan: dict, executed_ids: Set[str]) -> Optional[dict]:
-    steps = plan.get("steps", [])
-    for s in steps:
-        if (s.get("type") == "ui") and (s.get("id") not in executed_ids):
-            return s
-    return None
+async def _log_artifact_errors(session: AsyncSession, run) -> None:
+    # Screenshots are written in the background; report writes that failed so far,
+    # waiting for the last step's own write when the run is finishing.
+    if run.status == "DONE":
+        await asyncio.to_thread(flush_artifacts)
+    for err in take_artifact_errors(run.id):
+        add_log(session, run.id, "ERROR", "Screenshot write failed", err)
 
 
 @app.post("/runs/{run_id}/execute-first-ui-step")
@@ -400,39 +693,30 @@ async def execute_next_ui_step(run_id: int, session: AsyncSession = Depends(get_
     if not run:
         raise HTTPException(404, "Run not found")
 
-    plan = json.loads(run.plan_json)
+    if run.status == "PLANNING":
+        raise HTTPException(409, "Run is still planning")
+
+    plan, ui_indices = _load_plan_entry(run)
+    if "steps" not in plan:
+        raise HTTPException(409, "Run has no plan (planning failed)")
 
     # Use plan.starting_url (already normalized), but re-apply safe fallback rules anyway
     starting_url = _choose_starting_url(plan.get("starting_url"))
 
-    logs = (
-        await session.exec(
-            select(RunLog).where(RunLog.run_id == run_id).order_by(RunLog.ts)
-        )
-    ).all()
-
-    executed_ids = _executed_step_ids(logs)
-    ui_step = _pick_next_ui_step(plan, executed_ids)
-
-    if not ui_step:
+    # run.next_step_index counts completed ui steps, so it's the position of the next one.
+    if run.next_step_index >= len(ui_indices):
         run.status = "DONE"
-        run.updated_at = datetime.utcnow()
         session.add(run)
         await session.commit()
+        await _release_ui(run_id)
         return {"run_id": run_id, "status": "DONE", "executed_step_id": None}
 
+    step_index = ui_indices[run.next_step_index]
+    ui_step = plan["steps"][step_index]
     instruction = (ui_step.get("instruction") or "").strip() or "CLICK_TEXT: Example"
     step_id = ui_step.get("id")
 
-    # safer than list.index()
-    step_index = -1
-    for idx, s in enumerate(plan.get("steps", [])):
-        if s.get("id") == step_id:
-            step_index = idx
-            break
-
     run.status = "RUNNING"
-    run.updated_at = datetime.utcnow()
     session.add(run)
 
     add_log(
@@ -461,9 +745,10 @@ async def execute_next_ui_step(run_id: int, session: AsyncSession = Depends(get_
             "UI step executed",
             {"step_index": step_index, "step_id": step_id, "result": result},
         )
+        run.next_step_index += 1
+        run.status = "DONE" if run.next_step_index >= len(ui_indices) else "PLANNED"
 
-        remaining = _pick_next_ui_step(plan, executed_ids | {step_id})
-        run.status = "DONE" if remaining is None else "PLANNED"
+        await _log_artifact_errors(session, run)
 
     except Exception as e:
         add_log(
@@ -475,22 +760,101 @@ async def execute_next_ui_step(run_id: int, session: AsyncSession = Depends(get_
         )
         run.status = "ERROR"
 
-    run.updated_at = datetime.utcnow()
     session.add(run)
     await session.commit()
 
+    # ERROR isn't terminal: a retry re-runs the failed step, so keep the page (and any
+    # login/form state) for it. Abandoned errored runs are reclaimed by the idle sweeper.
+    if run.status == "DONE":
+        await _release_ui(run_id)
+
     return {"run_id": run_id, "status": run.status, "executed_step_id": step_id}
 
 
-@app.post("/runs/{run_id}/close-ui-session")
-async def close_ui_session(run_id: int, session: AsyncSession = Depends(get_session)):
+@app.post("/runs/{run_id}/execute-remaining-ui-steps")
+async def execute_remaining_ui_steps(run_id: int, session: AsyncSession = Depends(get_session)):
+    """
+    Execute every remaining UI step in one executor hop (see run_steps_stateful).
+    Stops at the first failing step; the steps before it still count as done.
+    """
+    run = await session.get(Run, run_id)
+    if not run:
+        raise HTTPException(404, "Run not found")
+
+    if run.status == "PLANNING":
+        raise HTTPException(409, "Run is still planning")
+
+    plan, ui_indices = _load_plan_entry(run)
+    if "steps" not in plan:
+        raise HTTPException(409, "Run has no plan (planning failed)")
+
+    starting_url = _choose_starting_url(plan.get("starting_url"))
+
+    if run.next_step_index >= len(ui_indices):
+        run.status = "DONE"
+        session.add(run)
+        await session.commit()
+        await _release_ui(run_id)
+        return {"run_id": run_id, "status": "DONE", "executed_step_ids": []}
+
+    steps = []
+    for step_index in ui_indices[run.next_step_index:]:
+        ui_step = plan["steps"][step_index]
+        instruction = (ui_step.get("instruction") or "").strip() or "CLICK_TEXT: Example"
+        steps.append({"step_index": step_index, "step_id": ui_step.get("id"), "instruction": instruction})
+
+    run.status = "RUNNING"
+    session.add(run)
+
+    add_log(session, run_id, "INFO", "Executing UI steps", {"starting_url": starting_url, "steps": steps})
+    await session.commit()
+
+    executed: list[str | None] = []
     try:
-        await _run_ui_in_executor(run_id, close_session, run_id, timeout_seconds=30)
-    except Exception:
-        close_session(run_id)
+        results = await _run_ui_in_executor(
+            run_id,
+            run_steps_stateful,
+            run_id,
+            starting_url,
+            [s["instruction"] for s in steps],
+            timeout_seconds=90 * len(steps),
+        )
 
-    ex = _UI_EXECUTORS.pop(run_id, None)
-    if ex:
-        ex.shutdown(wait=False, cancel_futures=True)
+        for step, result in zip(steps, results):
+            ref = {"step_index": step["step_index"], "step_id": step["step_id"]}
+            if not result["ok"]:
+                add_log(session, run_id, "ERROR", "UI step failed", {**ref, "error": result["error"]})
+                break
+            add_log(session, run_id, "INFO", "UI step executed", {**ref, "result": result})
+            executed.append(step["step_id"])
+
+        run.next_step_index += len(executed)
+        if run.next_step_index >= len(ui_indices):
+            run.status = "DONE"
+        else:
+            run.status = "ERROR" if len(executed) < len(results) else "PLANNED"
+        await _log_artifact_errors(session, run)
+
+    except Exception as e:
+        ref = {"step_index": steps[0]["step_index"], "step_id": steps[0]["step_id"]}
+        add_log(
+            session,
+            run_id,
+            "ERROR",
+            "UI step failed",
+            {**ref, "error": str(e), "traceback": traceback.format_exc()},
+        )
+        run.status = "ERROR"
+
+    session.add(run)
+    await session.commit()
 
-    return {"ok": True, "run_id": run_id}
+    if run.status == "DONE":
+        await _release_ui(run_id)
+
+    return {"run_id": run_id, "status": run.status, "executed_step_ids": executed}
+
+
+@app.post("/runs/{run_id}/close-ui-session")
+async def close_ui_session(run_id: int, session: AsyncSession = Depends(get_session)):
+    return {"ok": await _release_ui(run_id), "run_id": run_id}
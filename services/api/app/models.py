@@ -1,31 +1,53 @@
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import Optional
+from sqlalchemy import DateTime, Index, func
 from sqlmodel import SQLModel, Field
 
 
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
 class BrandDoc(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     title: str
     source: str = "manual"
     content: str
     tags: str = ""
-    embedding_json: str
-    created_at: datetime = Field(default_factory=datetime.utcnow)
+    # int8 embedding bytes + dequantization scale (see rag.embedding_to_bytes).
+    # Rows with a NULL scale hold float32 bytes (written before quantization).
+    embedding_blob: Optional[bytes] = None
+    embedding_scale: Optional[float] = None
+    # Legacy JSON-encoded embedding; only present on rows indexed before embedding_blob
+    embedding_json: Optional[str] = None
+    created_at: datetime = Field(default_factory=_utcnow, sa_type=DateTime(timezone=True))
 
 
 class Run(SQLModel, table=True):
+    __table_args__ = (Index("ix_run_updated_at", "updated_at"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
     task: str
     status: str = "PLANNED"
     plan_json: str = "{}"
-    created_at: datetime = Field(default_factory=datetime.utcnow)
-    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    # Number of ui steps completed = position of the next ui step to execute
+    next_step_index: int = 0
+    created_at: datetime = Field(default_factory=_utcnow, sa_type=DateTime(timezone=True))
+    # Set by Postgres on insert and on every UPDATE of the row; never assigned in Python.
+    updated_at: Optional[datetime] = Field(
+        default=None,
+        sa_type=DateTime(timezone=True),
+        sa_column_kwargs={"server_default": func.now(), "onupdate": func.now()},
+    )
 
 
 class RunLog(SQLModel, table=True):
+    # Logs are always read per run in (ts, id) order; also serves plain run_id lookups.
+    __table_args__ = (Index("ix_runlog_run_ts_id", "run_id", "ts", "id"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
-    run_id: int = Field(index=True)
-    ts: datetime = Field(default_factory=datetime.utcnow)
+    run_id: int
+    ts: datetime = Field(default_factory=_utcnow, sa_type=DateTime(timezone=True))
     level: str = "INFO"
     message: str
     data_json: str = "{}"
@@ -65,10 +65,13 @@ Otherwise:
 """
 
 
+_HTTP_URL_RE = re.compile(r"https?://[^\s)>\"]+", re.I)
+
+
 def _extract_first_http_url(text: str) -> str | None:
     if not text:
         return None
-    m = re.search(r"https?://[^\s)>\"]+", text.strip(), flags=re.I)
+    m = _HTTP_URL_RE.search(text.strip())
     return m.group(0) if m else None
 
 
@@ -1,22 +1,130 @@
-import math
+import numpy as np
+import orjson
 
+try:  # optional: parallel scoring for large brand kits
+    from numba import njit, prange
+except ImportError:
+    njit = None
 
-def cosine(a: list[float], b: list[float]) -> float:
+# Below this many rows BLAS matrix-vector is already faster than the thread fan-out.
+_NUMBA_MIN_ROWS = 10_000
+
+if njit is not None:
+
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _cosine_scores(matrix, q):
+        n, d = matrix.shape
+        out = np.empty(n, dtype=np.float32)
+        for i in prange(n):
+            acc = np.float32(0.0)
+            for j in range(d):
+                acc += matrix[i, j] * q[j]
+            out[i] = acc
+        return out
+
+else:
+    _cosine_scores = None
+
+
+def embedding_to_bytes(vec: list[float]) -> tuple[bytes, float]:
     """
-    Compute cosine similarity between vectors.
+    Encode an embedding for BrandDoc.embedding_blob as int8 (1 byte/dim) plus the
+    per-row scale stored in BrandDoc.embedding_scale. Only direction matters for
+    cosine scoring, so the vector is L2-normalized before quantizing.
     """
-    dot = sum(x * y for x, y in zip(a, b))
-    na = math.sqrt(sum(x * x for x in a)) or 1e-9
-    nb = math.sqrt(sum(y * y for y in b)) or 1e-9
-    return dot / (na * nb)
+    v = np.asarray(vec, dtype=np.float32)
+    v = v / (float(np.linalg.norm(v)) or 1e-9)
+    scale = (float(np.abs(v).max()) if v.size else 0.0) / 127 or 1.0
+    return np.round(v / scale).astype(np.int8).tobytes(), scale
 
 
-def top_k(query_vec: list[float], docs: list[tuple[int, str, str, list[float]]], k: int = 4):
+def embedding_from_row(blob: bytes | None, legacy_json: str | None, scale: float | None = None) -> np.ndarray:
     """
-    Return top-k docs by cosine similarity.
+    Decode a stored embedding: int8 blob when a scale is stored, float32 blob
+    (zero-copy view) for rows written before quantization, JSON for legacy rows.
     """
-    scored = []
-    for doc_id, title, content, vec in docs:
-        scored.append((cosine(query_vec, vec), doc_id, title, content))
-    scored.sort(reverse=True, key=lambda x: x[0])
-    return scored[:k]
+    if blob is not None:
+        if scale is not None:
+            return np.frombuffer(blob, dtype=np.int8) * np.float32(scale)
+        return np.frombuffer(blob, dtype=np.float32)
+    return np.asarray(orjson.loads(legacy_json or "[]"), dtype=np.float32)
+
+
+class DocIndex:
+    """
+    In-memory BrandDoc embeddings as one contiguous float32 matrix with a parallel
+    id array. Rows are L2-normalized on insert, so scoring a query is a single
+    matrix-vector product. Titles/content stay in the database.
+
+    `fingerprint` is (row count, max id) over every row handed to add(), including
+    skipped ones; compare it with the table to notice rows written by other processes.
+    """
+
+    def __init__(self, dim: int = 1024):
+        self.dim = dim
+        self.clear()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def clear(self) -> None:
+        self.ids = np.empty(0, dtype=np.int64)
+        self.matrix = np.empty((0, self.dim), dtype=np.float32)
+        self.fingerprint: tuple[int, int | None] = (0, None)
+
+    def add(self, docs: list[tuple[int, np.ndarray]]) -> None:
+        """
+        Append (id, embedding) rows. Embeddings of another
+        dimension can't be scored against the query and are skipped.
+        """
+        if not docs:
+            return
+        count, max_id = self.fingerprint
+        newest = max(d[0] for d in docs)
+        self.fingerprint = (count + len(docs), newest if max_id is None else max(max_id, newest))
+
+        docs = [d for d in docs if d[1].shape == (self.dim,)]
+        if not docs:
+            return
+
+        # Fill a preallocated block straight from the (zero-copy) row views.
+        rows = np.empty((len(docs), self.dim), dtype=np.float32)
+        for i, d in enumerate(docs):
+            rows[i] = d[1]
+        norms = np.linalg.norm(rows, axis=1, keepdims=True)
+        norms[norms == 0] = 1e-9
+        rows /= norms
+
+        ids = np.fromiter((d[0] for d in docs), dtype=np.int64, count=len(docs))
+        if len(self.ids):
+            self.matrix = np.concatenate((self.matrix, rows))
+            self.ids = np.concatenate((self.ids, ids))
+        else:
+            self.matrix, self.ids = rows, ids
+
+    def top_k(self, query_vec: list[float], k: int = 4) -> list[tuple[float, int]]:
+        """
+        Return top-k (score, id) by cosine similarity, best first.
+        """
+        n = len(self.ids)
+        k = min(k, n)
+        if k <= 0:
+            return []
+
+        q = np.asarray(query_vec, dtype=np.float32)
+        q = q / (float(np.linalg.norm(q)) or 1e-9)
+        if _cosine_scores is not None and n >= _NUMBA_MIN_ROWS:
+            scores = _cosine_scores(self.matrix, q)
+        else:
+            scores = self.matrix @ q
+
+        idx = np.argpartition(-scores, k - 1)[:k]
+        idx = idx[np.argsort(-scores[idx], kind="stable")]
+        return [(float(scores[i]), int(self.ids[i])) for i in idx]
+
+    def warmup(self) -> None:
+        """
+        Compile the optional numba kernel now so the first large query doesn't pay for it.
+        """
+        if _cosine_scores is not None:
+            _cosine_scores(np.zeros((1, self.dim), dtype=np.float32), np.zeros(self.dim, dtype=np.float32))
@@ -4,15 +4,18 @@ import asyncio
 import ipaddress
 import re
 import socket
+import string
 import sys
+import threading
 import time
-from dataclasses import dataclass
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
 from pathlib import Path
 from typing import Dict
 from urllib.parse import urlparse
 
-from .config import settings
+from . import config
 from .url_utils import sanitize_http_url
 
 # IMPORTANT: Playwright needs subprocess support on Windows.
@@ -20,22 +23,108 @@ from .url_utils import sanitize_http_url
 if sys.platform.startswith("win"):
     asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
 
-from playwright.sync_api import Browser, BrowserContext, Page, Playwright, sync_playwright
+from playwright.sync_api import Browser, BrowserContext, Locator, Page, Playwright, sync_playwright
 
 
 @dataclass
 class UISession:
-    playwright: Playwright
-    browser: Browser
     context: BrowserContext
     page: Page
     created_at: float
     last_used_at: float
     starting_url: str
+    # CSS selector -> Locator for the current document; cleared on main-frame navigation.
+    locators: Dict[str, Locator] = field(default_factory=dict)
 
 
 # Keep UI sessions in-memory (per run_id). Good enough for demos/hackathons.
+# Pool threads share the dict, so lookups/inserts/removals go through _SESSIONS_LOCK.
+# One run_id is only ever driven from one thread (the API's pool affinity), which is
+# what keeps creation for the same run serial; the lock is never held across Playwright
+# calls, so runs on other threads aren't blocked by a slow launch.
 _SESSIONS: Dict[int, UISession] = {}
+_SESSIONS_LOCK = threading.Lock()
+
+# One Playwright driver + Chromium per worker thread (sync Playwright objects only work
+# on the thread that created them). Runs get their own BrowserContext in it, which is
+# far cheaper than launching a browser per run.
+_LOCAL = threading.local()
+
+# runner.py is .../services/api/app/runner.py
+# parents[1] => .../services/api
+_SCREENSHOTS_DIR = Path(__file__).resolve().parents[1] / "artifacts" / "screenshots"
+# Per-run screenshot dirs already created (mkdir once per run, not per screenshot).
+_RUN_DIRS: Dict[int, Path] = {}
+
+# Screenshot files are written by one background thread so the UI worker moves on as
+# soon as it has the PNG bytes; a file shows up at its URL shortly after the step.
+_ARTIFACT_WRITER = ThreadPoolExecutor(max_workers=1, thread_name_prefix="artifact-writer")
+# Failed writes per run, until the API collects them with take_artifact_errors.
+_ARTIFACT_ERRORS: Dict[int, list[dict]] = {}
+_ARTIFACT_ERRORS_LOCK = threading.Lock()
+
+
+_FIELD_ID_RE = re.compile(r"[A-Za-z0-9_\-]+")
+_SAFE_LABEL_RE = re.compile(r"[^A-Za-z0-9_\-]+")
+_SAFE_LABEL_CHARS = frozenset(string.ascii_letters + string.digits + "_-")
+
+
+# Value parsers for the Runner DSL, keyed by verb. Each gets the text after the
+# first ":" and returns the spec, or None if the value is malformed (the caller
+# then falls back to CLICK_TEXT, as an unknown verb does).
+def _text_action(action: str):
+    def parse(rest: str) -> dict | None:
+        value = rest.strip()
+        return {"action": action, "value": value} if value else None
+
+    return parse
+
+
+def _parse_type_id(rest: str) -> dict | None:
+    field_id, sep, value = rest.partition("=")
+    field_id = field_id.strip()
+    if not sep or not _FIELD_ID_RE.fullmatch(field_id):
+        return None
+    return {"action": "type_id", "field_id": field_id, "value": value.lstrip()}
+
+
+def _parse_wait_ms(rest: str) -> dict | None:
+    ms = rest.strip()
+    return {"action": "wait_ms", "value": int(ms)} if ms.isdecimal() else None
+
+
+_SCREENSHOT_OPTIONS = frozenset(("full", "jpeg"))
+
+
+def _parse_screenshot(rest: str) -> dict:
+    # Trailing ":full" / ":jpeg" tokens (any order) are options, not part of the label.
+    label, options = rest.strip(), set()
+    while True:
+        head, sep, opt = label.rpartition(":")
+        opt = opt.strip().lower()
+        if not sep or opt not in _SCREENSHOT_OPTIONS:
+            break
+        options.add(opt)
+        label = head.strip()
+    return {
+        "action": "screenshot",
+        "value": label or "shot",
+        "full_page": "full" in options,
+        "format": "jpeg" if "jpeg" in options else "png",
+    }
+
+
+_ACTIONS = {
+    "CLICK_TEXT": _text_action("click_text"),
+    "CLICK_ID": _text_action("click_id"),
+    "CLICK_CSS": _text_action("click_css"),
+    "TYPE_ID": _parse_type_id,
+    "WAIT_TEXT": _text_action("wait_text"),
+    "ASSERT_TEXT": _text_action("assert_text"),
+    "WAIT_URL_CONTAINS": _text_action("wait_url_contains"),
+    "WAIT_MS": _parse_wait_ms,
+    "SCREENSHOT": _parse_screenshot,
+}
 
 
 def _parse_instruction(instruction: str) -> dict:
@@ -53,69 +142,79 @@ def _parse_instruction(instruction: str) -> dict:
       - ASSERT_TEXT: <text>
       - WAIT_URL_CONTAINS: <fragment>
       - WAIT_MS: <milliseconds>
-      - SCREENSHOT: <label>
+      - SCREENSHOT: <label>[:full][:jpeg]  (viewport PNG unless the options say otherwise)
     """
     instruction = (instruction or "").strip()
 
-    m = re.match(r"^CLICK_TEXT:\s*(.+)$", instruction, flags=re.I)
-    if m:
-        return {"action": "click_text", "value": m.group(1).strip()}
+    verb, sep, rest = instruction.partition(":")
+    if sep:
+        # Verbs are case-insensitive; the planner emits them upper-case.
+        parse = _ACTIONS.get(verb) or _ACTIONS.get(verb.upper())
+        spec = parse(rest) if parse else None
+        if spec is not None:
+            return spec
 
-    m = re.match(r"^CLICK_ID:\s*(.+)$", instruction, flags=re.I)
-    if m:
-        return {"action": "click_id", "value": m.group(1).strip()}
+    # Fallback: treat as CLICK_TEXT for convenience
+    return {"action": "click_text", "value": instruction}
 
-    m = re.match(r"^CLICK_CSS:\s*(.+)$", instruction, flags=re.I)
-    if m:
-        return {"action": "click_css", "value": m.group(1).strip()}
 
-    m = re.match(r"^TYPE_ID:\s*([A-Za-z0-9_\-]+)\s*=\s*(.*)$", instruction, flags=re.I)
-    if m:
-        return {"action": "type_id", "field_id": m.group(1).strip(), "value": m.group(2)}
+def _artifact_paths(run_id: int, label: str, ext: str = "png") -> tuple[Path, str]:
+    """
+    Returns (absolute_path, public_url_path) for an artifact file.
+    Public URL assumes FastAPI mounts /artifacts -> <services/api/artifacts>.
+    """
+    # Planner labels are usually already safe (e.g. after_login): skip the regex then.
+    safe = label if _SAFE_LABEL_CHARS.issuperset(label) else _SAFE_LABEL_RE.sub("_", label)
+    safe = safe.strip("_") or "shot"
+    ts = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S_%f")
+    filename = f"{ts}_{safe}.{ext}"
+
+    out_dir = _RUN_DIRS.get(run_id)
+    if out_dir is None:
+        out_dir = _SCREENSHOTS_DIR / f"run_{run_id}"
+        out_dir.mkdir(parents=True, exist_ok=True)
+        _RUN_DIRS[run_id] = out_dir
 
-    m = re.match(r"^WAIT_TEXT:\s*(.+)$", instruction, flags=re.I)
-    if m:
-        return {"action": "wait_text", "value": m.group(1).strip()}
+    abs_path = out_dir / filename
+    public_url = f"/artifacts/screenshots/run_{run_id}/{filename}"
+    return abs_path, public_url
 
-    m = re.match(r"^ASSERT_TEXT:\s*(.+)$", instruction, flags=re.I)
-    if m:
-        return {"action": "assert_text", "value": m.group(1).strip()}
 
-    m = re.match(r"^WAIT_URL_CONTAINS:\s*(.+)$", instruction, flags=re.I)
-    if m:
-        return {"action": "wait_url_contains", "value": m.group(1).strip()}
+def _write_artifact(path: Path, data: bytes) -> None:
+    # Write then rename, so /artifacts never serves a half-written file.
+    tmp = path.with_name(path.name + ".part")
+    tmp.write_bytes(data)
+    tmp.replace(path)
 
-    m = re.match(r"^WAIT_MS:\s*(\d+)\s*$", instruction, flags=re.I)
-    if m:
-        return {"action": "wait_ms", "value": int(m.group(1))}
 
-    m = re.match(r"^SCREENSHOT:\s*(.*)$", instruction, flags=re.I)
-    if m:
-        label = (m.group(1) or "").strip() or "shot"
-        return {"action": "screenshot", "value": label}
+def _queue_artifact(run_id: int, path: Path, public_url: str, data: bytes) -> None:
+    def _record_failure(fut) -> None:
+        if fut.cancelled():
+            error = "write cancelled"
+        elif fut.exception() is not None:
+            error = str(fut.exception())
+        else:
+            return
+        with _ARTIFACT_ERRORS_LOCK:
+            _ARTIFACT_ERRORS.setdefault(run_id, []).append({"screenshot_url": public_url, "error": error})
 
-    # Fallback: treat as CLICK_TEXT for convenience
-    return {"action": "click_text", "value": instruction}
+    _ARTIFACT_WRITER.submit(_write_artifact, path, data).add_done_callback(_record_failure)
 
 
-def _artifact_paths(run_id: int, label: str) -> tuple[Path, str]:
+def take_artifact_errors(run_id: int) -> list[dict]:
     """
-    Returns (absolute_path, public_url_path) for an artifact file.
-    Public URL assumes FastAPI mounts /artifacts -> <services/api/artifacts>.
+    Return (and forget) the run's failed screenshot writes so far.
+    Writes still queued aren't included; call flush_artifacts first to wait for them.
     """
-    safe = re.sub(r"[^A-Za-z0-9_\-]+", "_", label).strip("_") or "shot"
-    ts = datetime.utcnow().strftime("%Y%m%d_%H%M%S_%f")
-    filename = f"{ts}_{safe}.png"
+    with _ARTIFACT_ERRORS_LOCK:
+        return _ARTIFACT_ERRORS.pop(run_id, [])
 
-    # runner.py is .../services/api/app/runner.py
-    # parents[1] => .../services/api
-    base_dir = Path(__file__).resolve().parents[1]
-    out_dir = base_dir / "artifacts" / "screenshots" / f"run_{run_id}"
-    out_dir.mkdir(parents=True, exist_ok=True)
 
-    abs_path = out_dir / filename
-    public_url = f"/artifacts/screenshots/run_{run_id}/{filename}"
-    return abs_path, public_url
+def flush_artifacts() -> None:
+    """
+    Block until every queued artifact write has finished.
+    """
+    _ARTIFACT_WRITER.submit(lambda: None).result()
 
 
 def _is_blocked_ip(ip: str) -> bool:
@@ -143,12 +242,12 @@ def _resolve_hostname_block_if_private(hostname: str) -> None:
     A domain can DNS-resolve to 127.0.0.1 or private ranges.
     If ENABLE_DNS_SSRF_PROTECTION is enabled, block those.
     """
-    if not settings.ENABLE_DNS_SSRF_PROTECTION:
+    if not config.settings.ENABLE_DNS_SSRF_PROTECTION:
         return
 
     # Best-effort resolve with a short timeout.
     original_timeout = socket.getdefaulttimeout()
-    socket.setdefaulttimeout(settings.DNS_RESOLVE_TIMEOUT_S)
+    socket.setdefaulttimeout(config.settings.DNS_RESOLVE_TIMEOUT_S)
     try:
         try:
             infos = socket.getaddrinfo(hostname, None)
@@ -205,16 +304,51 @@ def _safe_starting_url(starting_url: str) -> str:
     if safe:
         return safe
 
-    demo = sanitize_http_url(settings.DEMO_STARTING_URL or "")
+    demo = sanitize_http_url(config.settings.DEMO_STARTING_URL or "")
     return demo or "https://the-internet.herokuapp.com/"
 
 
+def _ensure_browser() -> Browser:
+    """
+    Return this thread's browser, starting Playwright / relaunching Chromium as needed.
+    """
+    browser = getattr(_LOCAL, "browser", None)
+    if browser is not None and browser.is_connected():
+        return browser
+
+    pw: Playwright | None = getattr(_LOCAL, "playwright", None)
+    if pw is None:
+        pw = _LOCAL.playwright = sync_playwright().start()
+    browser = _LOCAL.browser = pw.chromium.launch(headless=config.settings.PLAYWRIGHT_HEADLESS)
+    return browser
+
+
+def shutdown_browser() -> None:
+    """
+    Close this thread's browser and stop its Playwright driver.
+    Call on each UI worker thread at shutdown, after its sessions are closed.
+    """
+    browser = getattr(_LOCAL, "browser", None)
+    pw = getattr(_LOCAL, "playwright", None)
+    _LOCAL.browser = _LOCAL.playwright = None
+    if browser is not None:
+        try:
+            browser.close()
+        except Exception:
+            pass
+    if pw is not None:
+        try:
+            pw.stop()
+        except Exception:
+            pass
+
+
 def _get_or_create_session(run_id: int, starting_url: str) -> UISession:
     """
     Create a single persistent Playwright session per run_id.
 
     NOTE: Must be called from the SAME thread each time for a given run_id.
-    FastAPI enforces this via a dedicated single-thread executor per run_id.
+    FastAPI enforces this by always running a run_id on the same single-thread pool.
     """
     safe_url = _safe_starting_url(starting_url)
 
@@ -222,70 +356,98 @@ def _get_or_create_session(run_id: int, starting_url: str) -> UISession:
     # (In demo mode, you probably always start from DEMO_STARTING_URL anyway.)
     _validate_public_http_url(safe_url)
 
-    sess = _SESSIONS.get(run_id)
+    with _SESSIONS_LOCK:
+        sess = _SESSIONS.get(run_id)
     if sess is not None:
-        sess.last_used_at = time.time()
-        # Do NOT re-navigate on the same run_id if a different URL slips in.
-        return sess
-
-    pw = sync_playwright().start()
-    browser = pw.chromium.launch(headless=settings.PLAYWRIGHT_HEADLESS)
-    context = browser.new_context()
-    page = context.new_page()
-
-    page.goto(safe_url, wait_until="domcontentloaded", timeout=60000)
+        browser = sess.context.browser
+        if not sess.page.is_closed() and (browser is None or browser.is_connected()):
+            sess.last_used_at = time.time()
+            # Do NOT re-navigate on the same run_id if a different URL slips in.
+            return sess
+        # The thread's browser crashed (or the page went away): every session on it
+        # is dead, so drop this one and start the run over in a fresh context.
+        try:
+            sess.context.close()
+        except Exception:
+            pass
+        with _SESSIONS_LOCK:
+            if _SESSIONS.get(run_id) is sess:
+                _SESSIONS.pop(run_id, None)
+
+    context = _ensure_browser().new_context()
+    try:
+        page = context.new_page()
+        page.goto(safe_url, wait_until="domcontentloaded", timeout=60000)
+    except Exception:
+        context.close()
+        raise
 
     sess = UISession(
-        playwright=pw,
-        browser=browser,
         context=context,
         page=page,
         created_at=time.time(),
         last_used_at=time.time(),
         starting_url=safe_url,
     )
-    _SESSIONS[run_id] = sess
+
+    def _on_navigated(frame) -> None:
+        if frame == page.main_frame:
+            sess.locators.clear()
+
+    page.on("framenavigated", _on_navigated)
+    with _SESSIONS_LOCK:
+        _SESSIONS[run_id] = sess
     return sess
 
 
+def _locator(sess: UISession, selector: str) -> Locator:
+    loc = sess.locators.get(selector)
+    if loc is None:
+        loc = sess.locators[selector] = sess.page.locator(selector)
+    return loc
+
+
 def close_session(run_id: int) -> None:
     """
-    Close and remove a UI session.
+    Close and remove a UI session. Call on the thread that created it.
+    If the close fails while the browser is still up, the session stays registered
+    (and the error propagates) so the close can be retried rather than leaking the context.
     """
-    sess = _SESSIONS.pop(run_id, None)
-    if not sess:
-        return
-    try:
-        sess.context.close()
-    except Exception:
-        pass
-    try:
-        sess.browser.close()
-    except Exception:
-        pass
-    try:
-        sess.playwright.stop()
-    except Exception:
-        pass
+    with _SESSIONS_LOCK:
+        sess = _SESSIONS.get(run_id)
+    if sess is not None:
+        try:
+            # Closes the run's page too; the thread's browser stays up for the next run.
+            sess.context.close()
+        except Exception:
+            browser = sess.context.browser
+            if browser is not None and browser.is_connected():
+                raise
+            # Browser is gone, and the context with it: nothing left to close.
 
+    with _SESSIONS_LOCK:
+        if _SESSIONS.get(run_id) is sess:
+            _SESSIONS.pop(run_id, None)
+        _RUN_DIRS.pop(run_id, None)
 
-def run_one_step_stateful(run_id: int, starting_url: str, instruction: str) -> dict:
+
+_TIMEOUT_CLICK_MS = 20000
+_TIMEOUT_WAIT_MS = 25000
+
+
+def _execute_spec(sess: UISession, run_id: int, spec: dict) -> dict:
     """
-    Execute ONE UI step using a persistent session.
-    Returns a small result payload for logging.
+    Perform one parsed instruction on the session's page.
+    Returns the extra result fields (screenshot path/url), or {}.
     """
-    safe_url = _safe_starting_url(starting_url)
-
-    sess = _get_or_create_session(run_id, safe_url)
     page = sess.page
 
-    spec = _parse_instruction(instruction)
-
-    # Small delay for stability
-    page.wait_for_timeout(250)
+    # Optional settle delay; Playwright's click/fill/wait_for already wait for actionability.
+    if config.settings.PLAYWRIGHT_PRE_STEP_DELAY_MS:
+        page.wait_for_timeout(config.settings.PLAYWRIGHT_PRE_STEP_DELAY_MS)
 
-    timeout_click = 20000
-    timeout_wait = 25000
+    timeout_click = _TIMEOUT_CLICK_MS
+    timeout_wait = _TIMEOUT_WAIT_MS
 
     action = spec["action"]
 
@@ -298,16 +460,16 @@ def run_one_step_stateful(run_id: int, starting_url: str, instruction: str) -> d
 
     elif action == "click_id":
         target = spec["value"]
-        page.locator(f"#{target}").click(timeout=timeout_click)
+        _locator(sess, f"#{target}").click(timeout=timeout_click)
 
     elif action == "click_css":
         css = spec["value"]
-        page.locator(css).first.click(timeout=timeout_click)
+        _locator(sess, css).first.click(timeout=timeout_click)
 
     elif action == "type_id":
         field_id = spec["field_id"]
         value = spec["value"]
-        locator = page.locator(f"#{field_id}")
+        locator = _locator(sess, f"#{field_id}")
         locator.wait_for(state="visible", timeout=timeout_wait)
         locator.fill(value, timeout=timeout_click)
 
@@ -334,34 +496,35 @@ def run_one_step_stateful(run_id: int, starting_url: str, instruction: str) -> d
 
     elif action == "screenshot":
         label = spec["value"]
-        abs_path, public_url = _artifact_paths(run_id, label)
-        page.screenshot(path=str(abs_path), full_page=True)
-
-        sess.last_used_at = time.time()
-        return {
-            "ok": True,
-            "runner": "playwright-local-stateful",
-            "run_id": run_id,
-            "starting_url": sess.starting_url,
-            "instruction": instruction,
-            "parsed": spec,
-            "final_url": page.url,
-            "title": page.title(),
-            "screenshot_path": str(abs_path),
-            "screenshot_url": public_url,
-        }
+        fmt = spec.get("format", "png")
+        abs_path, public_url = _artifact_paths(run_id, label, ext="jpg" if fmt == "jpeg" else "png")
+        # Viewport by default; stitching the whole page is opt-in (":full").
+        image = page.screenshot(
+            full_page=spec.get("full_page", False), type=fmt, quality=70 if fmt == "jpeg" else None
+        )
+        _queue_artifact(run_id, abs_path, public_url, image)
+        return {"title": page.title(), "screenshot_path": str(abs_path), "screenshot_url": public_url}
 
     else:
         raise ValueError(f"Unsupported action: {spec}")
 
+    return {}
+
+
+# Only these can start a navigation; waits/asserts/screenshots leave the page as is.
+_NAVIGATING_ACTIONS = frozenset(("click_text", "click_id", "click_css", "type_id"))
+
+
+def _wait_for_navigation(page: Page) -> None:
     # Let navigation finish if it happens
     try:
         page.wait_for_load_state("domcontentloaded", timeout=15000)
     except Exception:
         pass
 
-    sess.last_used_at = time.time()
 
+def _step_result(sess: UISession, run_id: int, instruction: str, spec: dict, extra: dict) -> dict:
+    # page.url is tracked client-side (no round-trip); title() is not.
     return {
         "ok": True,
         "runner": "playwright-local-stateful",
@@ -369,6 +532,75 @@ def run_one_step_stateful(run_id: int, starting_url: str, instruction: str) -> d
         "starting_url": sess.starting_url,
         "instruction": instruction,
         "parsed": spec,
-        "final_url": page.url,
-        "title": page.title(),
-    }
\ No newline at end of file
+        "final_url": sess.page.url,
+        **extra,
+    }
+
+
+def run_one_step_stateful(run_id: int, starting_url: str, instruction: str, include_title: bool = False) -> dict:
+    """
+    Execute ONE UI step using a persistent session.
+    Returns a small result payload for logging. page.title() is a browser round-trip,
+    so the title is only included for screenshots or when include_title is set.
+    """
+    safe_url = _safe_starting_url(starting_url)
+
+    sess = _get_or_create_session(run_id, safe_url)
+    spec = _parse_instruction(instruction)
+
+    extra = _execute_spec(sess, run_id, spec)
+    if spec["action"] in _NAVIGATING_ACTIONS:
+        _wait_for_navigation(sess.page)
+
+    sess.last_used_at = time.time()
+
+    result = _step_result(sess, run_id, instruction, spec, extra)
+    if include_title and "title" not in result:
+        result["title"] = sess.page.title()
+    return result
+
+
+def run_steps_stateful(
+    run_id: int, starting_url: str, instructions: list[str], include_title: bool = False
+) -> list[dict]:
+    """
+    Execute several UI steps in one call (one executor hop) on the run's session.
+
+    Actions auto-wait, so the navigation settle runs once after the batch (and before
+    screenshots) rather than after every step. Stops at the first failing step, whose
+    result has ok=False and the error; earlier results are kept. With include_title,
+    the last result also carries the page title.
+    """
+    safe_url = _safe_starting_url(starting_url)
+
+    sess = _get_or_create_session(run_id, safe_url)
+
+    results: list[dict] = []
+    settled = True
+    for instruction in instructions:
+        spec = None
+        try:
+            spec = _parse_instruction(instruction)
+            if spec["action"] == "screenshot" and not settled:
+                # Evidence must show the page the previous action led to.
+                _wait_for_navigation(sess.page)
+                settled = True
+            extra = _execute_spec(sess, run_id, spec)
+        except Exception as e:
+            results.append(
+                {"ok": False, "run_id": run_id, "instruction": instruction, "parsed": spec, "error": str(e)}
+            )
+            break
+        if spec["action"] in _NAVIGATING_ACTIONS:
+            settled = False
+        results.append(_step_result(sess, run_id, instruction, spec, extra))
+
+    if results and results[-1]["ok"]:
+        if not settled:
+            _wait_for_navigation(sess.page)
+        results[-1]["final_url"] = sess.page.url
+        if include_title and "title" not in results[-1]:
+            results[-1]["title"] = sess.page.title()
+
+    sess.last_used_at = time.time()
+    return results
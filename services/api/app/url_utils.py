@@ -1,13 +1,17 @@
 from __future__ import annotations
 
+from functools import lru_cache
 from typing import Optional
 from urllib.parse import urlparse
 
+_HTTP_PREFIXES = ("http://", "https://")
 
-def sanitize_http_url(url: str | None) -> Optional[str]:
+
+@lru_cache(maxsize=1024)
+def split_http_url(url: str | None) -> Optional[tuple[str, str]]:
     """
-    Accept only absolute http/https URLs with a hostname.
-    Returns normalized string or None.
+    Same acceptance rules as sanitize_http_url, but also returns the netloc.
+    Returns (normalized string, netloc) or None.
     """
     if not url:
         return None
@@ -15,6 +19,21 @@ def sanitize_http_url(url: str | None) -> Optional[str]:
     if not s:
         return None
 
+    # Fast path: lowercase http(s) prefix with a plain netloc needs no urlparse.
+    # IPv6 brackets and control characters fall through to urlparse below.
+    if s.startswith(_HTTP_PREFIXES):
+        rest = s.partition("://")[2]
+        netloc_end = len(rest)
+        for sep in "/?#":
+            i = rest.find(sep)
+            if i != -1 and i < netloc_end:
+                netloc_end = i
+        netloc = rest[:netloc_end]
+        if not netloc:
+            return None
+        if netloc.isprintable() and "[" not in netloc and "]" not in netloc:
+            return s, netloc
+
     try:
         p = urlparse(s)
     except Exception:
@@ -25,4 +44,13 @@ def sanitize_http_url(url: str | None) -> Optional[str]:
     if not p.netloc:
         return None
 
-    return s
+    return s, p.netloc
+
+
+def sanitize_http_url(url: str | None) -> Optional[str]:
+    """
+    Accept only absolute http/https URLs with a hostname.
+    Returns normalized string or None.
+    """
+    parsed = split_http_url(url)
+    return parsed[0] if parsed else None
@@ -1,11 +1,31 @@
 from __future__ import annotations
 import subprocess
 import sys
+from pathlib import Path
+
+
+def _chromium_installed() -> bool:
+    # Starting the driver and a browser is far cheaper than an install run. Headless
+    # launches use a separate headless-shell build, so launch one for real rather than
+    # trusting executable_path (the headed build) alone.
+    try:
+        from playwright.sync_api import sync_playwright
+
+        with sync_playwright() as pw:
+            if not Path(pw.chromium.executable_path).exists():
+                return False
+            pw.chromium.launch(headless=True).close()
+            return True
+    except Exception:
+        return False
 
 
 def install(*args, **kwargs) -> None:
     """
     Windows shim: Nova Act sometimes tries to import install_playwright.
     We keep this file to avoid import errors and to allow an idempotent install.
+    Skips the install subprocess when Chromium is already present.
     """
+    if _chromium_installed():
+        return
     subprocess.run([sys.executable, "-m", "playwright", "install", "chromium"], check=False)